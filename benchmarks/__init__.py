@@ -0,0 +1,44 @@
+# coding=utf-8
+
+import gc
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2; peak memory isn't reported
+    tracemalloc = None
+
+
+def measure(fn, repeat=20):
+    """
+    Call *fn* *repeat* times and return (mean seconds per call, peak bytes
+    allocated during a single call or None if that can't be measured).
+    """
+    # warm up (imports, caches, first-touch allocations)
+    fn()
+
+    gc.collect()
+    start = time.time()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.time() - start) / repeat
+
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def format_bytes(n):
+    if n is None:
+        return "n/a"
+
+    return "{:.1f}MB".format(n / (1024.0 * 1024))
@@ -0,0 +1,144 @@
+# coding=utf-8
+"""
+Measure the cold start cost of the Python Lambda handlers, broken down by
+the top-level package being imported and by lazily initialized value
+(source dataset, S3 client, colormaps, etc.).
+
+    python -m benchmarks.coldstart
+    python -m benchmarks.coldstart --output coldstart.json
+    python -m benchmarks.coldstart --baseline coldstart.json --threshold 1.2
+
+Each run happens in a fresh interpreter, from the function's directory (as
+Lambda does). With --baseline, exits non-zero if any handler's total cold
+start time regresses by more than --threshold.
+"""
+
+import argparse
+import json
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ["hillshade", "styles", "positron", "darkmatter", "terrain-grey-hills"]
+
+
+def environment(function):
+    """
+    The environment the function would be deployed with: project.json's,
+    overlaid with function.json's.
+    """
+    env = dict(os.environ)
+
+    for path in (os.path.join(ROOT, "project.json"), os.path.join(ROOT, "functions", function, "function.json")):
+        with open(path) as f:
+            env.update(json.load(f).get("environment", {}))
+
+    return env
+
+
+def profile(function):
+    """
+    Import a handler and initialize everything it initializes lazily,
+    returning the time spent on each. Must be run in a fresh interpreter.
+
+    Imports made while initializing are counted under both "imports" and
+    "init"; "total" is the wall time of the whole thing.
+    """
+    path = os.path.join(ROOT, "functions", function)
+    os.chdir(path)
+    sys.path.insert(0, path)
+
+    # load the import hook without importing the openterrain package
+    startup = runpy.run_path(os.path.join(ROOT, "openterrain", "startup.py"))
+
+    imports = {}
+    startup["install_import_hook"](imports)
+
+    start = time.time()
+    __import__("main")
+
+    lazy = sys.modules["openterrain.startup"]
+    for init in lazy.LAZY:
+        init()
+
+    return dict(imports=imports, init=dict(lazy.TIMINGS), total=time.time() - start)
+
+
+def run(function):
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.coldstart", "--child", function],
+        cwd=ROOT,
+        env=environment(function))
+
+    return json.loads(output.decode("utf-8"))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure handler cold start times")
+    parser.add_argument("functions", nargs="*", default=FUNCTIONS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="compare with results previously written with --output")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="maximum allowed ratio of total time to the baseline's")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+
+    if args.child:
+        sys.stdout.write(json.dumps(profile(args.child)))
+        return
+
+    results = {}
+    for function in args.functions:
+        runs = [run(function) for _ in range(args.repeat)]
+        result = {}
+
+        for kind in ("imports", "init"):
+            names = set(name for r in runs for name in r[kind])
+            result[kind] = dict((name, median([r[kind].get(name, 0) for r in runs])) for name in names)
+
+        result["total"] = median([r["total"] for r in runs])
+        results[function] = result
+
+        print("{} ({:.0f}ms)".format(function, result["total"] * 1000))
+        for kind in ("imports", "init"):
+            for name, elapsed in sorted(result[kind].items(), key=lambda item: -item[1]):
+                if elapsed >= 0.001:
+                    print("  {:<8} {:<40} {:8.1f}ms".format(kind, name, elapsed * 1000))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressed = False
+        for function, result in sorted(results.items()):
+            if function not in baseline:
+                continue
+
+            ratio = result["total"] / baseline[function]["total"]
+            print("{}: {:.0f}ms vs {:.0f}ms baseline ({:+.0%})".format(
+                function, result["total"] * 1000, baseline[function]["total"] * 1000, ratio - 1))
+
+            if ratio > args.threshold:
+                regressed = True
+
+        if regressed:
+            sys.exit("Cold start regressed by more than {:.0%}".format(args.threshold - 1))
+
+
+if __name__ == "__main__":
+    main()
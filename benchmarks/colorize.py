@@ -0,0 +1,78 @@
+# coding=utf-8
+"""
+Compare lookup-table colorizing with plt.imsave: PNG encode time per tile
+and the import cost each adds to a cold start.
+
+    python -m benchmarks.colorize
+
+The comparison needs matplotlib, which tiles are no longer rendered with
+(pip install -r benchmarks/requirements.txt).
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import measure
+from benchmarks.shading import synthetic_elevation
+from openterrain import DST_TILE_HEIGHT, DST_TILE_WIDTH
+from openterrain.colorize import compile_ramp, encode_png
+from openterrain.shading import shade
+from openterrain.styles import POSITRON_RAMP
+
+
+IMPORTS = [
+    ("numpy + PIL (colorize)", "import numpy; from PIL import Image"),
+    ("matplotlib (imsave)", "import matplotlib; matplotlib.use('Agg'); import matplotlib.pyplot"),
+]
+
+
+def import_time(statement, repeat=5):
+    """
+    Median wall time of starting a fresh interpreter and running
+    *statement*, less the time to start one that does nothing.
+    """
+    def run(code):
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable, "-c", code])
+            times.append(time.time() - start)
+
+        return sorted(times)[len(times) // 2]
+
+    return run(statement) - run("pass")
+
+
+def main():
+    hs = shade(synthetic_elevation((DST_TILE_HEIGHT, DST_TILE_WIDTH)), dx=38.2, dy=-38.2, vert_exag=1.3)
+    lut = compile_ramp(POSITRON_RAMP)
+
+    elapsed, _ = measure(lambda: compile_ramp(POSITRON_RAMP))
+    print("{:<24} {:8.2f}ms".format("compile_ramp", elapsed * 1000))
+
+    elapsed, _ = measure(lambda: encode_png(hs, lut))
+    print("{:<24} {:8.2f}ms".format("encode_png", elapsed * 1000))
+
+    try:
+        os.environ.setdefault("MPLBACKEND", "Agg")
+        from matplotlib.colors import LinearSegmentedColormap
+        import matplotlib.pyplot as plt
+        from StringIO import StringIO
+    except ImportError:
+        print("matplotlib isn't installed; skipping the plt.imsave comparison")
+    else:
+        cmap = LinearSegmentedColormap("positron", POSITRON_RAMP)
+        elapsed, _ = measure(lambda: plt.imsave(StringIO(), hs, cmap=cmap, vmin=0, vmax=255, format="png"))
+        print("{:<24} {:8.2f}ms".format("plt.imsave", elapsed * 1000))
+
+    for name, statement in IMPORTS:
+        try:
+            print("{:<24} {:8.2f}ms to import".format(name, import_time(statement) * 1000))
+        except subprocess.CalledProcessError:
+            print("{:<24} not installed".format(name))
+
+
+if __name__ == "__main__":
+    main()
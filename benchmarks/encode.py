@@ -0,0 +1,100 @@
+# coding=utf-8
+"""
+Compare tile encodings (RGBA and palette PNGs at several zlib levels, and
+WebP where Pillow supports it): encode time and bytes per tile for each
+style, across zooms, against an offline elevation source (as in
+benchmarks.render).
+
+    python -m benchmarks.encode
+    python -m benchmarks.encode --source mmap:///data/elevation --location -121.76 46.85 --output encode.json
+
+Sizes are of the @2x (512px) tiles that are rendered; 1x tiles are
+box-filtered from the same hillshades and scale with them.
+"""
+
+import argparse
+import json
+
+import mercantile
+
+from benchmarks import measure
+from benchmarks.render import LOCATION
+from benchmarks.sources import GeoTIFFSource, SyntheticSource
+from openterrain import get_source, MAX_ZOOM, render_hillshade, Tile
+from openterrain.colorize import encode_png, encode_webp, get_formats
+from openterrain.sources import open_source
+from openterrain.styles import get_colormap, STYLES
+
+
+# name, format, encode(data, lut)
+ENCODINGS = [
+    ("rgba-6", "png", lambda data, lut: encode_png(data, lut, compress_level=6, palette=False)),
+    ("palette-1", "png", lambda data, lut: encode_png(data, lut, compress_level=1, palette=True)),
+    ("palette-6", "png", lambda data, lut: encode_png(data, lut, compress_level=6, palette=True)),
+    ("palette-9", "png", lambda data, lut: encode_png(data, lut, compress_level=9, palette=True)),
+    ("webp-80", "webp", lambda data, lut: encode_webp(data, lut, quality=80, lossless=False)),
+    ("webp-lossless", "webp", lambda data, lut: encode_webp(data, lut, lossless=True)),
+]
+
+
+def main(argv=None):
+    names = [name for name, format, _ in ENCODINGS if format in get_formats()]
+
+    parser = argparse.ArgumentParser(description="Benchmark tile encodings")
+    parser.add_argument("--dem", help="local DEM to read from (default: synthetic)")
+    parser.add_argument("--source", help="elevation source to read from (see openterrain.sources)")
+    parser.add_argument("--zoom", type=int, nargs=2, default=(0, MAX_ZOOM), metavar=("MIN", "MAX"))
+    parser.add_argument("--location", type=float, nargs=2, default=LOCATION, metavar=("LON", "LAT"))
+    parser.add_argument("--styles", nargs="*", default=list(STYLES), choices=list(STYLES))
+    parser.add_argument("--encodings", nargs="*", default=names, choices=names)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON")
+
+    args = parser.parse_args(argv)
+
+    if args.source:
+        get_source.set(open_source(args.source))
+    elif args.dem:
+        get_source.set(GeoTIFFSource(args.dem))
+    else:
+        get_source.set(SyntheticSource())
+
+    results = {}
+    totals = dict(((style, name), [0, 0]) for style in args.styles for name in args.encodings)
+
+    print("{:<4} {:<20} {:<14} {:>9} {:>9}".format("zoom", "style", "encoding", "time", "bytes"))
+
+    for zoom in range(args.zoom[0], args.zoom[1] + 1):
+        tile = Tile(*mercantile.tile(args.location[0], args.location[1], zoom))
+        data = render_hillshade(tile, resample=True)
+
+        for style in args.styles:
+            lut = get_colormap(style)
+
+            for name, _, encode in ENCODINGS:
+                if name not in args.encodings:
+                    continue
+
+                elapsed, _ = measure(lambda: encode(data, lut), args.repeat)
+                size = len(encode(data, lut))
+                results["{}/{}/{}".format(zoom, style, name)] = dict(time=elapsed, bytes=size)
+                totals[(style, name)][0] += elapsed
+                totals[(style, name)][1] += size
+
+                print("{:<4} {:<20} {:<14} {:7.1f}ms {:9d}".format(zoom, style, name, elapsed * 1000, size))
+
+    zooms = args.zoom[1] - args.zoom[0] + 1
+
+    print("\nmean per tile")
+    for style in args.styles:
+        for name in args.encodings:
+            elapsed, size = totals[(style, name)]
+            print("{:<4} {:<20} {:<14} {:7.1f}ms {:9d}".format("", style, name, elapsed * 1000 / zooms, size // zooms))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""
+Check that rendering a metatile produces exactly the hillshades that
+rendering each of its tiles alone does, at every zoom and with and without
+resampling, and compare the time per tile.
+
+    python -m benchmarks.metatile
+    python -m benchmarks.metatile --size 8 --source mmap:///data/elevation --location -121.76 46.85
+
+Exits non-zero if any tile differs.
+"""
+
+import argparse
+import time
+
+import mercantile
+import numpy as np
+
+from benchmarks.render import LOCATION
+from benchmarks.sources import GeoTIFFSource, SyntheticSource
+from openterrain import get_source, MAX_ZOOM, METATILE_SIZE, render_hillshade, render_metatile, Tile
+from openterrain.sources import open_source
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare metatile and single-tile renders")
+    parser.add_argument("--dem", help="local DEM to read from (default: synthetic)")
+    parser.add_argument("--source", help="elevation source to read from (see openterrain.sources)")
+    parser.add_argument("--zoom", type=int, nargs=2, default=(0, MAX_ZOOM), metavar=("MIN", "MAX"))
+    parser.add_argument("--location", type=float, nargs=2, default=LOCATION, metavar=("LON", "LAT"))
+    parser.add_argument("--size", type=int, default=METATILE_SIZE, help="metatile size")
+
+    args = parser.parse_args(argv)
+
+    if args.source:
+        get_source.set(open_source(args.source))
+    elif args.dem:
+        get_source.set(GeoTIFFSource(args.dem))
+    else:
+        get_source.set(SyntheticSource())
+
+    mismatches = 0
+    print("{:<4} {:<9} {:>5} {:>9} {:>9} {:>9}".format("zoom", "resample", "tiles", "metatile", "single",
+                                                         "differ"))
+
+    for zoom in range(args.zoom[0], args.zoom[1] + 1):
+        tile = Tile(*mercantile.tile(args.location[0], args.location[1], zoom))
+
+        for resample in (True, False):
+            start = time.time()
+            tiles = render_metatile(tile, size=args.size, resample=resample)
+            metatile = (time.time() - start) / len(tiles)
+
+            start = time.time()
+            singles = [render_hillshade(t, resample=resample) for t, _, _ in tiles]
+            single = (time.time() - start) / len(tiles)
+
+            differ = sum(not np.array_equal(data, expected) for (_, data, _), expected in zip(tiles, singles))
+            mismatches += differ
+
+            print("{:<4} {:<9} {:>5} {:7.1f}ms {:7.1f}ms {:>9}".format(
+                zoom, "yes" if resample else "no", len(tiles), metatile * 1000, single * 1000, differ))
+
+    if mismatches:
+        raise SystemExit("{} tiles differ from their single-tile renders".format(mismatches))
+
+
+if __name__ == "__main__":
+    main()
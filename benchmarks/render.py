@@ -0,0 +1,164 @@
+# coding=utf-8
+"""
+Time the render pipeline at every zoom, with and without resampling and
+slopeshade, against an offline elevation source (a synthetic DEM, or a
+local one with --dem, or any elevation source with --source), reporting per-stage wall time, throughput and peak
+memory.
+
+    python -m benchmarks.render
+    python -m benchmarks.render --dem rainier.tif --output render.json
+    python -m benchmarks.render --source mmap:///data/elevation --location -121.76 46.85
+    python -m benchmarks.render --baseline render.json --threshold 1.2
+
+"read" is the time spent in the source's read() (so mostly the stand-in's
+own cost), "render" is the rest of render_hillshade(), "tif" and "png" are
+encode_hillshade() and colorizing + encode_png(). "peak" is the most
+allocated during any one stage, "rss" the process's peak resident set size
+while benchmarking that zoom/variant (on Linux; elsewhere, since it
+started). --arena-size sets the scratch buffers kept between renders (0 to
+allocate them every time). With --baseline, exits
+non-zero if any zoom/variant's total time regresses by more than
+--threshold.
+"""
+
+import argparse
+import json
+import sys
+
+import mercantile
+
+import openterrain
+from benchmarks import format_bytes, measure
+from benchmarks.sources import GeoTIFFSource, SyntheticSource, TimedSource
+from openterrain import encode_hillshade, get_arena, get_source, MAX_ZOOM, render_hillshade, Tile
+from openterrain.arena import Arena
+from openterrain.sources import open_source
+from openterrain.colorize import compile_ramp, encode_png
+from openterrain.styles import POSITRON_RAMP
+from openterrain.timing import reset_peak_rss, rss
+
+
+# Mount Rainier
+LOCATION = (-121.7603, 46.8529)
+
+# name, resample, add_slopeshade
+VARIANTS = [
+    ("resample+slopeshade", True, True),
+    ("resample", True, False),
+    ("slopeshade", False, True),
+    ("plain", False, False),
+]
+
+STAGES = ["read", "render", "tif", "png"]
+
+
+def benchmark(tile, resample, add_slopeshade, repeat):
+    reset_peak_rss()
+    source = get_source()
+    lut = compile_ramp(POSITRON_RAMP)
+    meta = {}
+
+    def render():
+        return render_hillshade(tile, src_meta=meta, resample=resample, add_slopeshade=add_slopeshade)
+
+    source.elapsed = source.reads = 0
+    elapsed, render_peak = measure(render, repeat)
+    read = source.elapsed / source.reads
+
+    data = render()
+    tif, tif_peak = measure(lambda: encode_hillshade(data, dict(meta)), repeat)
+    png, png_peak = measure(lambda: encode_png(data, lut), repeat)
+
+    total = elapsed + tif + png
+
+    return {
+        "time": dict(read=read, render=elapsed - read, tif=tif, png=png),
+        # reads are included in render's peak
+        "peak": dict(read=None, render=render_peak, tif=tif_peak, png=png_peak),
+        "total": total,
+        "tiles_per_second": 1 / total,
+        "max_rss": rss()[1],
+    }
+
+
+def peak(result):
+    peaks = [p for p in result["peak"].values() if p is not None]
+
+    return max(peaks) if peaks else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rendering against an offline elevation source")
+    parser.add_argument("--dem", help="local DEM to read from (default: synthetic)")
+    parser.add_argument("--source", help="elevation source to read from (see openterrain.sources)")
+    parser.add_argument("--zoom", type=int, nargs=2, default=(0, MAX_ZOOM), metavar=("MIN", "MAX"))
+    parser.add_argument("--location", type=float, nargs=2, default=LOCATION, metavar=("LON", "LAT"))
+    parser.add_argument("--variants", nargs="*", default=[name for name, _, _ in VARIANTS],
+                        choices=[name for name, _, _ in VARIANTS])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--arena-size", type=int, default=openterrain.ARENA_SIZE,
+                        help="scratch buffers to keep between renders (in MB)")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="compare with results previously written with --output")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="maximum allowed ratio of total time to the baseline's")
+
+    args = parser.parse_args(argv)
+
+    if args.source:
+        source = open_source(args.source)
+    elif args.dem:
+        source = GeoTIFFSource(args.dem)
+    else:
+        source = SyntheticSource()
+
+    get_source.set(TimedSource(source))
+    get_arena.set(Arena(args.arena_size * 1024 * 1024))
+
+    results = {}
+    print("{:<4} {:<20} {}  {:>9}  {:>9}  {:>9}".format(
+        "zoom", "variant", " ".join("{:>9}".format(stage) for stage in STAGES), "tiles/s", "peak", "rss"))
+
+    for zoom in range(args.zoom[0], args.zoom[1] + 1):
+        tile = Tile(*mercantile.tile(args.location[0], args.location[1], zoom))
+
+        for name, resample, add_slopeshade in VARIANTS:
+            if name not in args.variants:
+                continue
+
+            result = benchmark(tile, resample, add_slopeshade, args.repeat)
+            results["{}/{}".format(zoom, name)] = result
+
+            print("{:<4} {:<20} {}  {:9.1f}  {:>9}  {:>9}".format(
+                zoom,
+                name,
+                " ".join("{:7.1f}ms".format(result["time"][stage] * 1000) for stage in STAGES),
+                result["tiles_per_second"],
+                format_bytes(peak(result)),
+                format_bytes(result["max_rss"])))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressed = False
+        for key, result in sorted(results.items()):
+            if key not in baseline:
+                continue
+
+            ratio = result["total"] / baseline[key]["total"]
+            if ratio > args.threshold:
+                regressed = True
+                print("{}: {:.1f}ms vs {:.1f}ms baseline ({:+.0%})".format(
+                    key, result["total"] * 1000, baseline[key]["total"] * 1000, ratio - 1))
+
+        if regressed:
+            sys.exit("Rendering regressed by more than {:.0%}".format(args.threshold - 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""
+Compare openterrain.resampling with GDAL's bilinear reproject() on buffered
+tiles, at every factor in RESAMPLING: elevation downsampled to the scaled
+size (in float32) and hillshades upsampled back (in uint8), and the time
+each takes.
+
+    python -m benchmarks.resampling
+
+Exits non-zero if a downsampled pixel differs by more than float32
+precision or an upsampled one by more than TOLERANCE (other than the ones
+GDAL leaves unwritten along the far edges).
+"""
+
+import numpy as np
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+
+from benchmarks import measure
+from benchmarks.shading import synthetic_elevation
+from openterrain import BUFFER, DST_TILE_HEIGHT, DST_TILE_WIDTH, RESAMPLING
+from openterrain.resampling import resample, TOLERANCE
+from openterrain.sources import WorldSource
+
+
+# tiles inside the world, and along its edges (which aren't buffered beyond them)
+SHAPES = [
+    (DST_TILE_HEIGHT + 2 * BUFFER, DST_TILE_WIDTH + 2 * BUFFER),
+    (DST_TILE_HEIGHT + BUFFER, DST_TILE_WIDTH + 2 * BUFFER),
+    (DST_TILE_HEIGHT + BUFFER, DST_TILE_WIDTH + BUFFER),
+]
+
+# relative to the largest value
+FLOAT_TOLERANCE = 1e-6
+
+
+def gdal(data, out, factor, upsample=False):
+    aff = WorldSource.affine
+    scaled = aff * aff.scale(1 / factor)
+    src_transform, dst_transform = (scaled, aff) if upsample else (aff, scaled)
+
+    reproject(data, out, src_transform=src_transform, dst_transform=dst_transform, src_crs=WorldSource.crs,
+              dst_crs=WorldSource.crs, resampling=Resampling.bilinear)
+
+    return out
+
+
+def main():
+    failures = 0
+    rng = np.random.RandomState(0)
+
+    print("{:<7} {:<9} {:<9} {:>10} {:>9} {:>9}".format("factor", "shape", "", "difference", "time", "gdal"))
+
+    for factor in sorted(set(RESAMPLING.values())):
+        for shape in SHAPES:
+            scaled = (int(round(shape[0] * factor)), int(round(shape[1] * factor)))
+            elevation = synthetic_elevation(shape)
+            hs = rng.randint(0, 256, size=scaled).astype(np.uint8)
+
+            down = np.empty(scaled, dtype=np.float32)
+            up = np.empty(shape, dtype=np.uint8)
+
+            expected = gdal(elevation, np.zeros(scaled, dtype=np.float32), factor)
+            resample(elevation, down, 1 / factor)
+            down_diff = np.abs(down - expected).max() / np.abs(expected).max()
+
+            # pixels GDAL doesn't write keep whatever they were initialized to
+            expected = gdal(hs, np.zeros(shape, dtype=np.uint8), factor, upsample=True)
+            written = expected == gdal(hs, np.full(shape, 255, dtype=np.uint8), factor, upsample=True)
+            resample(hs, up, factor)
+            up_diff = np.abs(up.astype(np.int16) - expected)[written].max()
+
+            for direction, diff, failed, (ours, theirs) in [
+                ("down", "{:.1e}".format(down_diff), down_diff > FLOAT_TOLERANCE, (
+                    measure(lambda: resample(elevation, down, 1 / factor))[0],
+                    measure(lambda: gdal(elevation, down, factor))[0])),
+                ("up", up_diff, up_diff > TOLERANCE, (
+                    measure(lambda: resample(hs, up, factor))[0],
+                    measure(lambda: gdal(hs, up, factor, upsample=True))[0])),
+            ]:
+                failures += failed
+                print("{:<7} {:<9} {:<9} {:>10} {:7.2f}ms {:7.2f}ms".format(
+                    factor, "{}x{}".format(shape[1], shape[0]), direction, diff, ours * 1000, theirs * 1000))
+
+    if failures:
+        raise SystemExit("{} resamplings differ from GDAL's by more than the tolerance".format(failures))
+
+
+if __name__ == "__main__":
+    main()
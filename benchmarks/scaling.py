@@ -0,0 +1,71 @@
+# coding=utf-8
+"""
+Time shade() on buffered windows of 1x1 to 4x4 tiles (metatiles) in row
+strips on 1 to N threads, checking that every result is identical to the
+serial one.
+
+    python -m benchmarks.scaling
+    python -m benchmarks.scaling --workers 8 --metatiles 4 8
+
+"speedup" is relative to shading the same window serially; "efficiency"
+is speedup per thread.
+"""
+
+import argparse
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+
+import numpy as np
+
+from benchmarks import measure
+from benchmarks.shading import DX, DY, synthetic_elevation, VERT_EXAG
+from openterrain import BUFFER, DST_TILE_HEIGHT, DST_TILE_WIDTH
+from openterrain.shading import shade, strips
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark strip-parallel shading")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="most threads to shade on")
+    parser.add_argument("--metatiles", type=int, nargs="*", default=[1, 2, 4],
+                        help="window sizes, in tiles along each side")
+    parser.add_argument("--repeat", type=int, default=10)
+
+    args = parser.parse_args(argv)
+
+    print("{:<10} {:>7} {:>6} {:>9} {:>8} {:>10}".format(
+        "window", "threads", "strips", "time", "speedup", "efficiency"))
+
+    for size in args.metatiles:
+        shape = (DST_TILE_HEIGHT * size + 2 * BUFFER, DST_TILE_WIDTH * size + 2 * BUFFER)
+        elevation = synthetic_elevation(shape)
+        scratch = tuple(np.empty(shape, dtype=np.float32) for _ in range(3))
+        out = np.empty(shape, dtype=np.uint8)
+        serial = shade(elevation, dx=DX, dy=-DY, vert_exag=VERT_EXAG)
+        baseline = None
+
+        for workers in range(1, args.workers + 1):
+            pool = ThreadPool(workers) if workers > 1 else None
+
+            def run():
+                return shade(elevation, dx=DX, dy=-DY, vert_exag=VERT_EXAG, out=out, scratch=scratch,
+                             workers=workers, pool=pool)
+
+            try:
+                elapsed, _ = measure(run, args.repeat)
+
+                if not np.array_equal(run(), serial):
+                    raise SystemExit("{} thread(s) on {}x{}: result differs from serial".format(
+                        workers, shape[1], shape[0]))
+            finally:
+                if pool is not None:
+                    pool.terminate()
+
+            baseline = baseline or elapsed
+            print("{:<10} {:>7} {:>6} {:7.1f}ms {:7.2f}x {:>10.0%}".format(
+                "{}x{}".format(shape[1], shape[0]), workers, len(strips(shape[0], workers)), elapsed * 1000,
+                baseline / elapsed, baseline / elapsed / workers))
+
+
+if __name__ == "__main__":
+    main()
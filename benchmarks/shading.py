@@ -0,0 +1,54 @@
+# coding=utf-8
+"""
+Compare the fused shade() kernel with the hillshade() * slopeshade()
+reference on a synthetic buffered tile.
+
+    python -m benchmarks.shading
+"""
+
+import numpy as np
+
+from benchmarks import format_bytes, measure
+from openterrain import BUFFER, DST_TILE_HEIGHT, DST_TILE_WIDTH, hillshade, slopeshade
+from openterrain.shading import shade, TOLERANCE
+
+
+# a z12 tile: SRC pixel size at z14 scaled by 2**2
+DX = DY = 9.554628535647032 * 4
+VERT_EXAG = 1.3
+
+
+def synthetic_elevation(shape, seed=0):
+    rng = np.random.RandomState(seed)
+    # random walk surface, roughly mountainous in range and slope
+    surface = np.cumsum(np.cumsum(rng.randn(*shape), axis=0), axis=1)
+    return (surface * 10).astype(np.int16).astype(np.float32)
+
+
+def reference(elevation):
+    hs = hillshade(elevation, dx=DX, dy=-DY, vert_exag=VERT_EXAG)
+    hs *= slopeshade(elevation, dx=DX, dy=-DY, vert_exag=VERT_EXAG)
+
+    return (255.0 * hs).astype(np.uint8)
+
+
+def main():
+    shape = (DST_TILE_HEIGHT + 2 * BUFFER, DST_TILE_WIDTH + 2 * BUFFER)
+    elevation = synthetic_elevation(shape)
+    out = np.empty(shape, dtype=np.uint8)
+
+    diff = np.abs(reference(elevation).astype(np.int16) - shade(elevation, dx=DX, dy=-DY, vert_exag=VERT_EXAG))
+    print("{}x{} tile, max difference {} (tolerance {}), {:.4%} of pixels differ".format(
+        shape[1], shape[0], diff.max(), TOLERANCE, np.count_nonzero(diff) / float(diff.size)))
+
+    for name, fn in [
+        ("hillshade * slopeshade", lambda: reference(elevation)),
+        ("shade", lambda: shade(elevation, dx=DX, dy=-DY, vert_exag=VERT_EXAG)),
+        ("shade (out=)", lambda: shade(elevation, dx=DX, dy=-DY, vert_exag=VERT_EXAG, out=out)),
+    ]:
+        elapsed, peak = measure(fn)
+        print("{:<24} {:8.2f}ms  peak {}".format(name, elapsed * 1000, format_bytes(peak)))
+
+
+if __name__ == "__main__":
+    main()
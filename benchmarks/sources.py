@@ -0,0 +1,106 @@
+# coding=utf-8
+"""
+Offline stand-ins for the mapzen.xml elevation source, for benchmarking
+without the network:
+
+    from openterrain import get_source
+    get_source.set(SyntheticSource())
+
+Both are openterrain.sources.WorldSources, covering the same grid as
+mapzen.xml. For real elevation without the network, stage a region with
+openterrain.sources and read it from there (mmap:///path).
+"""
+
+import time
+
+from affine import Affine
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+
+from openterrain.sources import WorldSource
+
+
+class SyntheticSource(WorldSource):
+    """
+    A smooth, deterministic DEM (a sum of sinusoids of a few wavelengths,
+    -500m to ~4500m) defined everywhere, so reads at any zoom agree with
+    each other.
+    """
+
+    # (amplitude in m, wavelengths in SRC_TILE_ZOOM pixels along rows and columns)
+    WAVES = [
+        (2000, 300000, 410000),
+        (900, 21000, 17000),
+        (400, 2300, 3100),
+        (90, 270, 190),
+        (25, 31, 23),
+    ]
+
+    def read(self, band, out, window):
+        (row_start, row_stop), (col_start, col_stop) = window
+        height, width = out.shape
+
+        # sample at the centers of the output pixels
+        rows = row_start + (np.arange(height) + 0.5) * (row_stop - row_start) / float(height)
+        cols = col_start + (np.arange(width) + 0.5) * (col_stop - col_start) / float(width)
+
+        elevation = np.full(out.shape, 2000, dtype=np.float32)
+        for amplitude, row_wavelength, col_wavelength in self.WAVES:
+            elevation += (amplitude * np.sin(2 * np.pi * rows / row_wavelength).astype(np.float32)[:, np.newaxis] *
+                          np.cos(2 * np.pi * cols / col_wavelength).astype(np.float32)[np.newaxis, :])
+
+        out[:] = elevation
+
+        return out
+
+
+class GeoTIFFSource(WorldSource):
+    """
+    A local DEM (any GDAL-readable raster, in any projection) warped onto
+    the mapzen.xml grid as it's read. Areas it doesn't cover are 0.
+    """
+
+    def __init__(self, path):
+        self.dataset = rasterio.open(path)
+
+    def read(self, band, out, window):
+        (row_start, row_stop), (col_start, col_stop) = window
+        height, width = out.shape
+
+        out.fill(0)
+        reproject(
+            rasterio.band(self.dataset, band),
+            out,
+            dst_transform=self.window_transform(window) * Affine.scale((col_stop - col_start) / float(width),
+                                                                       (row_stop - row_start) / float(height)),
+            dst_crs=self.crs,
+            dst_nodata=0,
+            resampling=Resampling.bilinear,
+        )
+
+        return out
+
+
+class TimedSource(object):
+    """
+    Wraps a source, accumulating the time spent in (and number of) reads.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.elapsed = 0
+        self.reads = 0
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def read(self, band, out, window):
+        start = time.time()
+
+        try:
+            return self.source.read(band, out=out, window=window)
+        finally:
+            self.elapsed += time.time() - start
+            self.reads += 1
@@ -1,39 +1,24 @@
+import hashlib
+import os
 import re
-from StringIO import StringIO
 
-from matplotlib.colors import LinearSegmentedColormap
-import matplotlib.pyplot as plt
-from PIL import Image
 import rasterio
 
-from openterrain import MAX_ZOOM, render_hillshade, Tile
-
-POSITRON_RAMP = {
-    "red": [(0.0, 0.0, 0.3),
-            (1.0, 1.0, 1.0)],
-    "green": [(0.0, 0.0, 0.3),
-              (1.0, 1.0, 1.0)],
-    "blue": [(0.0, 0.0, 0.3),
-             (1.0, 1.0, 1.0)],
-    "alpha": [(0.0, 0.7, 0.7),
-              (195 / 255.0, 0.0, 0.0),
-              (1.0, 1.0, 1.0)]
-}
-POSITRON = LinearSegmentedColormap("positron", POSITRON_RAMP)
-
-DARKMATTER_RAMP = {
-    "red": [(0.0, 60 / 255.0, 60 / 255.0),
-            (1.0, 220 / 255.0, 220 / 255.0)],
-    "green": [(0.0, 75 / 255.0, 75 / 255.0),
-              (1.0, 1.0, 1.0)],
-    "blue": [(0.0, 80 / 255.0, 80 / 255.0),
-             (1.0, 100 / 255.0, 100 / 255.0)],
-    "alpha": [(0.0, 0.4, 0.4),
-              (180 / 255.0, 0.0, 0.0),
-              (1.0, 0.2, 0.2)]
-}
-
-DARKMATTER = LinearSegmentedColormap("darkmatter", DARKMATTER_RAMP)
+from openterrain import MAX_METATILE_SIZE, MAX_ZOOM, METATILE_SIZE, render_hillshade, render_metatile, Tile
+from openterrain import batch
+from openterrain.cache import LRUCache
+from openterrain.colorize import encode_png, encode_tiles
+from openterrain.singleflight import SingleFlight
+from openterrain.styles import get_colormap, STYLES
+
+# rendered PNGs, keyed by (style, tile, scale) (in MB)
+TILE_CACHE_SIZE = int(os.environ.get("TILE_CACHE_SIZE", 64))
+
+# (png, etag) pairs
+TILES = LRUCache(TILE_CACHE_SIZE * 1024 * 1024, sizeof=lambda tile: len(tile[0]))
+
+# concurrent requests for the same (uncached) tile share a single render
+RENDERS = SingleFlight()
 
 
 def main():
@@ -55,73 +40,135 @@ def main():
     with rasterio.open("hillshade_combined_resampled.tif", "w", **meta) as tmp:
         tmp.write(data, 1)
 
-    plt.imsave(
-        "darkmatter_combined_resampled.png",
-        data,
-        cmap=DARKMATTER,
-        vmin=0,
-        vmax=255,
-        format="png",
-    )
+    with open("darkmatter_combined_resampled.png", "wb") as f:
+        f.write(encode_png(data, get_colormap("darkmatter")))
 
-    plt.imsave(
-        "positron_combined_resampled.png",
-        data,
-        cmap=POSITRON,
-        vmin=0,
-        vmax=255,
-        format="png",
-    )
+    with open("positron_combined_resampled.png", "wb") as f:
+        f.write(encode_png(data, get_colormap("positron")))
+
+def tile_path(tile, scale, style="positron"):
+    return "/{}/{}/{}/{}{}.png".format(style, tile.z, tile.x, tile.y, "@2x" if scale == 2 else "")
 
-def handle(event):
-    zoom = int(event["params"]["path"]["z"])
-    x = int(event["params"]["path"]["x"])
-    filename, format = event["params"]["path"]["y"].split(".")
 
-    parts = filename.split("@")
-    y = int(parts[0])
-    if len(parts) > 1:
-        scale = int(re.sub(r"[^\d]", "", parts[1]))
-    else:
-        scale = 1
+def parse_tile(z, x, y):
+    """
+    Parse and validate a tile path's components (y may include a scale and
+    must include the format, e.g. "1582@2x.png"), returning (tile, scale).
+    Raises ValueError if they're invalid.
+    """
+    try:
+        zoom = int(z)
+        x = int(x)
+        filename, format = y.split(".")
+
+        parts = filename.split("@")
+        y = int(parts[0])
+        if len(parts) > 1:
+            scale = int(re.sub(r"[^\d]", "", parts[1]))
+        else:
+            scale = 1
+    except ValueError:
+        raise ValueError("Invalid path")
 
     tile = Tile(x, y, zoom)
 
     if format != "png":
-        raise Exception("Invalid format")
+        raise ValueError("Invalid format")
 
     if not 0 <= tile.z <= MAX_ZOOM:
-        raise Exception("Invalid zoom")
+        raise ValueError("Invalid zoom")
 
     if not 0 < scale <= 2:
-        raise Exception("Invalid scale")
+        raise ValueError("Invalid scale")
 
     if not 0 <= tile.x < 2**tile.z:
-        raise Exception("Invalid coordinates")
+        raise ValueError("Invalid coordinates")
 
     if not 0 <= tile.y < 2**tile.z:
-        raise Exception("Invalid coordinates")
+        raise ValueError("Invalid coordinates")
+
+    return tile, scale
+
+
+def cache_tile(style, tile, scale, data):
+    entry = (data, '"{}"'.format(hashlib.sha1(data).hexdigest()))
+    TILES.put((style, tile, scale), entry)
+
+    return entry
+
+
+def get_tile(style, tile, scale):
+    """
+    Return a tile's PNG and its (strong) ETag, from the tile cache if
+    possible.
+    """
+    entry = TILES.get((style, tile, scale))
+
+    if entry is None:
+        entry, _ = RENDERS.do((style, tile, scale), lambda: render_tile(style, tile, scale))
+
+    return entry
+
 
+def render_tile(style, tile, scale):
     hs = render_hillshade(tile, resample=True)
+    [(_, data)] = encode_tiles(hs, get_colormap(style), scales=(scale,))
 
-    out = StringIO()
-    plt.imsave(
-        out,
-        hs,
-        cmap=POSITRON,
-        # cmap=plt.get_cmap("Accent"), # use a default coloramp
-        vmin=0,
-        vmax=255,
-        format=format,
-    )
+    return cache_tile(style, tile, scale, data)
+
+
+def render_tiles(tiles, scale, metatile, style="positron"):
+    """
+    Render *tiles* (all in the same metatile) from a single source read into
+    the tile cache, returning their paths.
+    """
+    for t, hs, _ in render_metatile(tiles[0], size=metatile):
+        if t in tiles:
+            [(_, data)] = encode_tiles(hs, get_colormap(style), scales=(scale,))
+            cache_tile(style, t, scale, data)
+
+    return dict((t, tile_path(t, scale, style)) for t in tiles)
+
+
+def handle_batch(spec, context=None):
+    """
+    Render a batch of tiles (see openterrain.batch) into the tile cache.
+    Raises ValueError if *spec* is invalid.
+    """
+    tiles = batch.parse_tiles(spec)
+
+    try:
+        metatile = int(spec.get("metatile", METATILE_SIZE))
+        scale = int(spec.get("scale", 1))
+    except (OverflowError, TypeError, ValueError):
+        raise ValueError("Invalid batch")
+
+    style = spec.get("style", "positron")
+
+    if not isinstance(style, basestring) or style not in STYLES:
+        raise ValueError("Invalid style")
+
+    if not 0 < scale <= 2:
+        raise ValueError("Invalid scale")
+
+    if not 0 < metatile <= MAX_METATILE_SIZE:
+        raise ValueError("Invalid metatile size")
+
+    return batch.run(batch.group_tiles(tiles, metatile), lambda group: render_tiles(group, scale, metatile, style),
+                     context=context)
+
+
+def handle(event):
+    path = event["params"]["path"]
+    style = path.get("style", "positron")
+
+    if not isinstance(style, basestring) or style not in STYLES:
+        raise ValueError("Invalid style")
 
-    if scale == 1:
-        im = Image.open(out)
-        im.thumbnail((256, 256), Image.ANTIALIAS)
-        out = StringIO()
-        im.save(out, format)
+    tile, scale = parse_tile(path["z"], path["x"], path["y"])
+    data, _ = get_tile(style, tile, scale)
 
-    return out.getvalue()
+    return data
 
 
 if __name__ == "__main__":
@@ -1,17 +1,52 @@
-from raven import Client
+from openterrain import MAX_METATILE_SIZE, MAX_ZOOM, METATILE_SIZE, render_metatile, save_hillshades, Tile
+from openterrain import batch
+from openterrain.startup import lazy
+from openterrain.timing import request
 
-from openterrain import MAX_ZOOM, render_hillshade, save_hillshade, Tile
 
+@lazy
+def get_sentry():
+    from raven import Client
 
-sentry = Client()
+    return Client()
+
+
+def render_tiles(tiles, metatile):
+    """
+    Render *tiles* (all in the same metatile) from a single source read and
+    save them (concurrently), returning their URLs.
+    """
+    rendered = [(t, data, meta) for t, data, meta in render_metatile(tiles[0], size=metatile) if t in tiles]
+
+    return dict(zip([t for t, _, _ in rendered], save_hillshades(rendered)))
+
+
+def handle_batch(event, context):
+    tiles = batch.parse_tiles(event["batch"])
+    metatile = int(event["batch"].get("metatile", METATILE_SIZE))
+
+    if not 0 < metatile <= MAX_METATILE_SIZE:
+        raise Exception("Invalid metatile size")
+
+    with request(function="hillshade", tiles=len(tiles), metatile=metatile):
+        return batch.run(
+            batch.group_tiles(tiles, metatile),
+            lambda group: render_tiles(group, metatile),
+            context=context,
+            on_error=lambda exc_info: get_sentry().captureException(exc_info=exc_info),
+        )
 
 
 def handle(event, context):
+    if "batch" in event:
+        return handle_batch(event, context)
+
     zoom = int(event["params"]["path"]["z"])
     x = int(event["params"]["path"]["x"])
     y, format = event["params"]["path"]["y"].split(".")
     y = int(y)
     tile = Tile(x, y, zoom)
+    metatile = int(event["params"].get("querystring", {}).get("metatile", 1))
 
     if format != "tif":
         raise Exception("Invalid format")
@@ -25,15 +60,21 @@ def handle(event, context):
     if not 0 <= tile.y < 2**tile.z:
         raise Exception("Invalid coordinates")
 
+    if not 0 < metatile <= MAX_METATILE_SIZE:
+        raise Exception("Invalid metatile size")
+
     # TODO maybe check if the tile already exists (but maybe we actually want to overwrite it)
 
-    meta = {}
-    try:
-        location = save_hillshade(tile, data=render_hillshade(tile, src_meta=meta), meta=meta)
-    except:
-        sentry.captureException()
-        raise
+    with request(function="hillshade", tile="{}/{}/{}".format(tile.z, tile.x, tile.y), metatile=metatile):
+        try:
+            # render every tile in the metatile from a single source read and save them all (concurrently)
+            tiles = render_metatile(tile, size=metatile)
+            locations = dict(zip([t for t, _, _ in tiles], save_hillshades(tiles)))
+        except:
+            get_sentry().captureException()
+            raise
 
     return {
-        "location": location
+        "location": locations[tile],
+        "locations": sorted(locations.values()),
     }
@@ -0,0 +1,6 @@
+from openterrain import styles
+
+
+def handle(event, context):
+    # every style, from a single hillshade per tile
+    return styles.handle(event, context)
@@ -1,19 +1,35 @@
 # coding=utf-8
 
-from collections import namedtuple
+from collections import Counter, namedtuple
 import copy
 import os
+import tempfile
+import threading
+import time
+from StringIO import StringIO
 
 from affine import Affine
-import boto3
 import mercantile
 import numpy as np
+from PIL import Image
 import rasterio
 from rasterio import Affine
-from rasterio.enums import Resampling
-from rasterio.warp import reproject
 from rasterio._io import virtual_file_to_buffer
 
+from openterrain.arena import Arena
+from openterrain.cache import ExpiringSet, LRUCache
+from openterrain.emptytiles import EmptyTiles
+from openterrain.prefetch import active as prefetching, neighbours, Prefetcher
+from openterrain.resampling import resample as resample_bilinear
+from openterrain.shading import shade
+from openterrain.singleflight import Lease, Leases, SingleFlight
+from openterrain.sourcecache import CachedSource, SourceTileCache
+from openterrain.sources import open_source, ThreadLocalDataset
+from openterrain.startup import lazy
+from openterrain.tilestore import open_store
+from openterrain.timing import span
+from openterrain.writebehind import WriteBehind
+
 
 BUFFER = 2
 MAX_ZOOM = 15
@@ -24,8 +40,64 @@ SRC_TILE_HEIGHT = 512
 DST_TILE_WIDTH = 512
 DST_TILE_HEIGHT = 512
 DST_BLOCK_SIZE = 256
+METATILE_SIZE = 4
+MAX_METATILE_SIZE = 8
 TMP_PATH = "/vsimem/tmp-{}".format(os.getpid())
-SRC = rasterio.open("mapzen.xml")
+
+# where elevation is read from (see openterrain.sources): a GDAL dataset
+# or mmap:///path for a local store of raw tiles
+ELEVATION_SOURCE = os.environ.get("ELEVATION_SOURCE", "mapzen.xml")
+
+# optional on-disk cache of source tiles (read through a GDAL dataset),
+# shared between processes
+SOURCE_CACHE_PATH = os.environ.get("SOURCE_CACHE_PATH")
+# in MB
+SOURCE_CACHE_SIZE = int(os.environ.get("SOURCE_CACHE_SIZE", 256))
+
+# in-process cache of hillshades, shared by everything rendered from them
+# (in MB)
+HILLSHADE_CACHE_SIZE = int(os.environ.get("HILLSHADE_CACHE_SIZE", 64))
+# how long (in seconds) to remember that a hillshade isn't in S3
+MISSING_HILLSHADE_TTL = int(os.environ.get("MISSING_HILLSHADE_TTL", 60))
+# file recording the tiles known to be empty, shared between processes on
+# this host (see openterrain.emptytiles); if unset, they're only
+# remembered in memory
+EMPTY_TILE_INDEX = os.environ.get("EMPTY_TILE_INDEX")
+
+# save newly rendered hillshades in the background (see flush_hillshades())
+WRITE_BEHIND = os.environ.get("WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+# hillshades (or metatiles) waiting to be saved before rendering blocks
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 8))
+
+# lock files coordinating renders between processes on this host (see
+# openterrain.singleflight); if unset, renders are only coalesced within a
+# process
+RENDER_LOCK_PATH = os.environ.get("RENDER_LOCK_PATH")
+# how long (in seconds) to wait for another process's render before
+# rendering anyway
+RENDER_LOCK_TIMEOUT = int(os.environ.get("RENDER_LOCK_TIMEOUT", 30))
+# renders (and saves) of a metatile within this many seconds of the last
+# are counted as duplicates
+DUPLICATE_WINDOW = int(os.environ.get("DUPLICATE_WINDOW", 60))
+
+# fetch (rendering, if necessary) the neighbours and children of each tile
+# get_hillshade() is asked for in the background, on PREFETCH_WORKERS
+# threads, when no other renders are in progress (see openterrain.prefetch)
+PREFETCH = os.environ.get("PREFETCH", "").lower() in ("1", "true", "yes")
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", 1))
+# tiles waiting to be prefetched; older ones are dropped
+PREFETCH_QUEUE_SIZE = int(os.environ.get("PREFETCH_QUEUE_SIZE", 32))
+# most prefetches started per second
+PREFETCH_RATE = float(os.environ.get("PREFETCH_RATE", 2))
+
+# scratch buffers kept between renders, in total across threads (in MB; 0
+# to allocate them afresh for each render)
+ARENA_SIZE = int(os.environ.get("ARENA_SIZE", 96))
+
+# threads each window (e.g. a metatile) is shaded on at once, in row strips
+# (see openterrain.shading.shade()); shared by concurrent renders
+SHADE_WORKERS = int(os.environ.get("SHADE_WORKERS", 1))
+
 
 # from http://www.shadedrelief.com/web_relief/
 EXAGGERATION = {
@@ -58,55 +130,453 @@ RESAMPLING = {
     13: 0.9,
 }
 
-S3_BUCKET = os.environ["S3_BUCKET"]
+S3_BUCKET = os.environ.get("S3_BUCKET")
+
+# where hillshades (and styled tiles) are stored, as a URL (see
+# openterrain.tilestore); S3_BUCKET if unset
+TILE_STORE = os.environ.get("TILE_STORE")
+
+# S3 connections kept open per process (and so the number of concurrent
+# uploads)
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 16))
+# attempts per S3 request, including the first
+S3_MAX_ATTEMPTS = int(os.environ.get("S3_MAX_ATTEMPTS", 5))
 
 Tile = namedtuple("Tile", "x y z")
 
+# get_hillshade() lookups: "memory" and "s3" hits, "s3_misses", "missing"
+# (known not to be in S3, so not fetched), "empty" (known to be empty, so
+# neither fetched nor rendered), "shared_fetches" (taken from another
+# thread's fetch) and "rendered"; hillshades
+# "coalesced" (taken from another thread's or process's render) and
+# "duplicate_renders" and "duplicate_puts" (see DUPLICATE_WINDOW)
+HILLSHADE_STATS = Counter()
+
+
+@lazy
+def get_source():
+    src = open_source(ELEVATION_SOURCE)
+
+    if SOURCE_CACHE_PATH and isinstance(src, ThreadLocalDataset):
+        cache = SourceTileCache(SOURCE_CACHE_PATH, max_size=SOURCE_CACHE_SIZE * 1024 * 1024)
+        src = CachedSource(src, cache, max_zoom=SRC_TILE_ZOOM)
+
+    return src
+
+
+@lazy
+def get_s3():
+    import boto3
+    from botocore.config import Config
+
+    return boto3.resource("s3", config=Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        retries={"total_max_attempts": S3_MAX_ATTEMPTS},
+    ))
+
+
+@lazy
+def get_upload_pool():
+    from multiprocessing.pool import ThreadPool
+
+    return ThreadPool(S3_MAX_POOL_CONNECTIONS)
+
+
+@lazy
+def get_store():
+    return open_store(TILE_STORE or "s3://{}".format(S3_BUCKET), s3_client=lambda: get_s3().meta.client,
+                      pool=get_upload_pool)
+
+
+def put_objects(objects):
+    """
+    Store tiles (each a dict of put_object() arguments) in the tile store
+    (concurrently, for S3), returning their URLs once all of them have been
+    stored. The first error is raised.
+    """
+    with span("store_put", objects=len(objects), bytes=sum(len(o["Body"]) for o in objects)):
+        return get_store().put(objects)
+
+
+@lazy
+def get_shade_pool():
+    if SHADE_WORKERS > 1:
+        from multiprocessing.pool import ThreadPool
+
+        return ThreadPool(SHADE_WORKERS)
+
+
+@lazy
+def get_arena():
+    """
+    Return the process's scratch buffers (see render_metatile).
+    """
+    return Arena(ARENA_SIZE * 1024 * 1024)
+
+
+@lazy
+def get_hillshade_cache():
+    return LRUCache(HILLSHADE_CACHE_SIZE * 1024 * 1024)
+
+
+@lazy
+def get_missing_hillshades():
+    return ExpiringSet(MISSING_HILLSHADE_TTL)
+
+
+@lazy
+def get_empty_tiles():
+    return EmptyTiles(EMPTY_TILE_INDEX)
+
+
+_empty_hillshades = {}
+
+
+def empty_hillshade(add_slopeshade=True):
+    """
+    Return the (shared, read-only) hillshade of a tile whose source window
+    is entirely 0.
+    """
+    data = _empty_hillshades.get(add_slopeshade)
+
+    if data is None:
+        # flat ground has no gradient, so it's shaded the same whatever the
+        # zoom, pixel size, exaggeration or resampling
+        value = shade(np.zeros((3, 3), dtype=np.float32), add_slopeshade=add_slopeshade)[1, 1]
+        data = np.full((DST_TILE_HEIGHT, DST_TILE_WIDTH), value, dtype=np.uint8)
+        data.flags.writeable = False
+        _empty_hillshades[add_slopeshade] = data
+
+    return data
+
+
+@lazy
+def get_writer():
+    return WriteBehind(WRITE_BEHIND_QUEUE_SIZE)
+
+
+@lazy
+def get_renders():
+    return SingleFlight()
+
+
+@lazy
+def get_fetches():
+    return SingleFlight()
+
+
+@lazy
+def get_leases():
+    if RENDER_LOCK_PATH:
+        return Leases(RENDER_LOCK_PATH, timeout=RENDER_LOCK_TIMEOUT)
+
+
+@lazy
+def get_recent_renders():
+    return ExpiringSet(DUPLICATE_WINDOW)
+
+
+@lazy
+def get_prefetcher():
+    def fetch(tile):
+        # saved on the prefetching thread, so that live requests' flush_hillshades() don't wait for (or report)
+        # prefetched tiles
+        get_hillshade(tile, write_behind=False)
+
+    def busy():
+        # fetches and renders in progress other than the prefetcher's own are live ones
+        in_flight = get_fetches().stats()["in_flight"] + get_renders().stats()["in_flight"]
+
+        return in_flight > prefetcher.fetching
+
+    prefetcher = Prefetcher(fetch, workers=PREFETCH_WORKERS, max_pending=PREFETCH_QUEUE_SIZE, rate=PREFETCH_RATE,
+                            busy=busy)
+
+    return prefetcher
+
+
+def acquire_lease(name):
+    leases = get_leases()
+
+    if leases is None:
+        return Lease()
+
+    return leases.acquire(name)
+
+
+def flush_hillshades():
+    """
+    Wait for hillshades being saved in the background to be stored,
+    returning the exc_info of each save that failed. Must be called before
+    a request finishes, as the process may be frozen (or exit) afterwards.
+    """
+    return get_writer().flush()
+
+
+def get_hillshade(tile, cache=True, write_behind=WRITE_BEHIND):
+    """
+    Return *tile*'s hillshade from memory, S3 or by rendering it (in that
+    order), optionally caching newly rendered hillshades in S3 (in the
+    background, with *write_behind*). The array returned is shared and
+    read-only. With PREFETCH, the tiles likely to be asked for next are
+    queued to be prefetched.
+    """
+    if PREFETCH and not prefetching():
+        prefetcher = get_prefetcher()
+        prefetcher.used(tile)
+        prefetcher.schedule(neighbours(tile, MAX_ZOOM))
+
+    data = find_hillshade(tile)
+
+    if data is not None:
+        return data
+
+    with span("hillshade", source="rendered"):
+        [(_, data)] = get_metatile(tile, size=1, cache=cache, write_behind=write_behind)
+
+    return data
+
+
+def get_hillshades(tiles, size=METATILE_SIZE, cache=True, write_behind=WRITE_BEHIND):
+    """
+    Return a list of (tile, data) for *tiles*, which must all be in the same
+    metatile of *size*. Hillshades are taken from memory or S3 where
+    possible; if any are missing, the metatile is rendered (once, from a
+    single source read) as by get_metatile().
+    """
+    hillshades = [(t, find_hillshade(t)) for t in tiles]
+
+    if any(data is None for _, data in hillshades):
+        rendered = dict(get_metatile(tiles[0], size=size, cache=cache, write_behind=write_behind))
+        hillshades = [(t, rendered[t] if data is None else data) for t, data in hillshades]
+
+    return hillshades
+
+
+def find_hillshade(tile):
+    """
+    Return *tile*'s hillshade from memory or S3, or None if it hasn't been
+    rendered (which is remembered for MISSING_HILLSHADE_TTL seconds, or
+    until it's rendered here). Concurrent lookups of the same tile share a
+    single fetch.
+    """
+    hillshades = get_hillshade_cache()
+    missing = get_missing_hillshades()
+
+    data = hillshades.get(tile)
+
+    if data is not None:
+        HILLSHADE_STATS["memory"] += 1
+        with span("hillshade", source="memory"):
+            return data
+
+    if tile in get_empty_tiles():
+        HILLSHADE_STATS["empty"] += 1
+        with span("hillshade", source="empty"):
+            return empty_hillshade()
+
+    if tile in missing:
+        HILLSHADE_STATS["missing"] += 1
+        return None
+
+    def fetch():
+        data = fetch_hillshade(tile)
+
+        if data is None:
+            HILLSHADE_STATS["s3_misses"] += 1
+            missing.add(tile)
+            return None
+
+        HILLSHADE_STATS["s3"] += 1
+
+        data.flags.writeable = False
+        hillshades.put(tile, data)
+
+        return data
+
+    data, shared = get_fetches().do(tile, fetch)
+
+    if shared:
+        HILLSHADE_STATS["shared_fetches"] += 1
+
+    return data
+
+
+def fetch_hillshade(tile):
+    """
+    Fetch *tile*'s hillshade from the tile store with a single request,
+    returning None if it hasn't been rendered. Other errors are raised.
+    """
+    with span("store_get") as s:
+        body = get_store().get(hillshade_key(tile))
+
+        if body is None:
+            s["hit"] = False
+            return None
+
+        s.update(hit=True, bytes=len(body))
 
-def get_hillshade(tile, cache=True):
-    s3 = boto3.resource("s3")
+    with span("tif_decode"):
+        return decode_hillshade(body)
 
-    key = "3857/{}/{}/{}.tif".format(tile.z, tile.x, tile.y)
 
+def decode_hillshade(body):
+    """
+    Decode a hillshade encoded by encode_hillshade().
+    """
     try:
-        s3.Object(
-            S3_BUCKET,
-            key,
-        ).load()
+        return np.asarray(Image.open(StringIO(body)))
+    except IOError:
+        # hillshades stored with sparse_ok leave out all-zero blocks, which PIL can't read
+        with tempfile.NamedTemporaryFile(suffix=".tif") as f:
+            f.write(body)
+            f.flush()
+
+            with rasterio.open(f.name) as src:
+                return src.read(1)
+
+
+def get_metatile(tile, size=METATILE_SIZE, cache=True, write_behind=WRITE_BEHIND):
+    """
+    Render the metatile containing *tile* and return its hillshades as a
+    list of (tile, data) pairs, optionally caching each of them (in the
+    background, with *write_behind*). Concurrent calls for the same
+    metatile share a single render (see render_and_store()).
+    """
+    key = (tile.z,) + metatile_bounds(tile, size)
+    hillshades, shared = get_renders().do(key, lambda: render_and_store(tile, size, cache, write_behind))
+
+    if shared:
+        HILLSHADE_STATS["coalesced"] += len(hillshades)
+
+    return hillshades
+
+
+def render_and_store(tile, size, cache, write_behind):
+    """
+    Render (and optionally store) the metatile containing *tile* while
+    holding its lease, unless another process stored it while this one was
+    waiting for the lease. Returns a list of (tile, data) pairs.
+    """
+    mx, my, width, height = metatile_bounds(tile, size)
+    key = (tile.z, mx, my, width, height)
+    lease = acquire_lease("{}/{}/{}-{}x{}".format(tile.z, mx, my, width, height))
+    hillshades = get_hillshade_cache()
 
-        with rasterio.open("s3://{}/{}".format(S3_BUCKET, key)) as src:
-            return src.read(1)
-    except:
-        meta = {}
-        data = render_hillshade(tile, src_meta=meta)
+    try:
+        if lease.waited:
+            tiles = [Tile(x, y, tile.z) for y in range(my, my + height) for x in range(mx, mx + width)]
+            stored = list(zip(tiles, get_upload_pool().map(fetch_hillshade, tiles)))
+
+            if all(data is not None for _, data in stored):
+                HILLSHADE_STATS["coalesced"] += len(stored)
+                lease.release(completed=False)
+
+                for t, data in stored:
+                    get_missing_hillshades().discard(t)
+                    data.flags.writeable = False
+                    hillshades.put(t, data)
+
+                return stored
+
+        duplicate = key in get_recent_renders() or \
+            (lease.released_at is not None and time.time() - lease.released_at < DUPLICATE_WINDOW)
+
+        # tiles are views of the metatile; cached ones shouldn't keep all of it alive (the cache only counts their
+        # own size)
+        tiles = [(t, np.ascontiguousarray(data), meta) for t, data, meta in render_metatile(tile, size=size)]
+        get_recent_renders().add(key)
+        HILLSHADE_STATS["rendered"] += len(tiles)
+
+        if duplicate:
+            HILLSHADE_STATS["duplicate_renders"] += len(tiles)
+    except Exception:
+        lease.release(completed=False)
+        raise
+
+    if cache:
+        if duplicate:
+            HILLSHADE_STATS["duplicate_puts"] += len(tiles)
+
+        if write_behind:
+            get_writer().submit(save_leased_hillshades, tiles, lease)
+        else:
+            save_leased_hillshades(tiles, lease)
+    else:
+        lease.release(completed=False)
 
+    for t, data, _ in tiles:
         if cache:
-            save_hillshade(tile, data=data, meta=meta)
+            get_missing_hillshades().discard(t)
 
-        return data
+        data.flags.writeable = False
+        hillshades.put(t, data)
+
+    return [(t, data) for t, data, _ in tiles]
+
+
+def metatile_bounds(tile, size=METATILE_SIZE):
+    """
+    Return the (x, y, width, height), in tiles, of the size x size block
+    aligned to multiples of *size* that contains *tile*, clipped to the
+    edges of the world.
+    """
+    size = min(size, 2**tile.z)
+    x = tile.x - tile.x % size
+    y = tile.y - tile.y % size
+
+    return x, y, min(size, 2**tile.z - x), min(size, 2**tile.z - y)
 
 
 def render_hillshade(tile, src_meta={}, resample=True, add_slopeshade=True):
+    [(_, data, meta)] = render_metatile(tile, size=1, resample=resample, add_slopeshade=add_slopeshade)
+    src_meta.update(meta)
+
+    return data
+
+
+def render_metatile(tile, size=METATILE_SIZE, resample=True, add_slopeshade=True):
+    """
+    Render the metatile containing *tile* (see metatile_bounds) from a
+    single buffered source read and return a list of (tile, data, meta)
+    for each of the tiles it covers, identical to rendering each of them
+    alone (at zooms that are resampled, each tile is resampled and shaded
+    from its own part of the window). Metatiles whose source windows are
+    entirely 0 aren't shaded, and are recorded as empty (see
+    get_empty_tiles()) so that they aren't read again either.
+    """
+    # everything but the hillshades returned lives in reused scratch buffers
+    with get_arena().checkout() as arena:
+        return _render_metatile(tile, size, resample, add_slopeshade, arena)
+
+
+def _render_metatile(tile, size, resample, add_slopeshade, arena):
+    src = get_source()
+    mx, my, width, height = metatile_bounds(tile, size)
+    covered = [Tile(mx + i, my + j, tile.z) for j in range(height) for i in range(width)]
+    empty_tiles = get_empty_tiles()
+
+    if all(t in empty_tiles for t in covered):
+        return [(t, empty_hillshade(add_slopeshade), hillshade_meta(t)) for t in covered]
+
     # do calculations in SRC_TILE_ZOOM space
     dz = SRC_TILE_ZOOM - tile.z
-    x = 2**dz * tile.x
-    y = 2**dz * tile.y
-    mx = 2**dz * (tile.x + 1)
-    my = 2**dz * (tile.y + 1)
-    dx = mx - x
-    dy = my - y
+    x = 2**dz * mx
+    y = 2**dz * my
+    dx = 2**dz
+    dy = 2**dz
     top = (2**SRC_TILE_ZOOM * SRC_TILE_HEIGHT) - 1
 
     # y, x (rows, columns)
     # window is measured in pixels at SRC_TILE_ZOOM
     window = [
               [
-               top - (top - (SRC_TILE_HEIGHT * y)),
-               top - (top - ((SRC_TILE_HEIGHT * y) + int(SRC_TILE_HEIGHT * dy)))
+               SRC_TILE_HEIGHT * y,
+               (SRC_TILE_HEIGHT * y) + int(SRC_TILE_HEIGHT * dy * height)
               ],
               [
                SRC_TILE_WIDTH * x,
-               (SRC_TILE_WIDTH * x) + int(SRC_TILE_WIDTH * dx)
+               (SRC_TILE_WIDTH * x) + int(SRC_TILE_WIDTH * dx * width)
               ]
              ]
 
@@ -137,126 +607,203 @@ def render_hillshade(tile, src_meta={}, resample=True, add_slopeshade=True):
     buffered_window[1][0] -= left_buffer * scale
     buffered_window[1][1] += right_buffer * scale
 
+    shape = (DST_TILE_HEIGHT * height + top_buffer + bottom_buffer,
+             DST_TILE_WIDTH * width + left_buffer + right_buffer)
+
     # use decimated reads to read from overviews, per https://github.com/mapbox/rasterio/issues/710
-    data = np.empty(shape=(DST_TILE_WIDTH + left_buffer + right_buffer, DST_TILE_HEIGHT + top_buffer + bottom_buffer)).astype(SRC.profile["dtype"])
-    data = SRC.read(1, out=data, window=buffered_window)
+    data = arena.get("source", shape, src.profile["dtype"])
+    cache = getattr(src, "cache", None)
+    with span("source_read", bytes=data.nbytes) as s:
+        if cache is not None:
+            hits, misses = cache.hits, cache.misses
+
+        data = src.read(1, out=data, window=buffered_window)
+
+        if cache is not None:
+            s.update(cache_hits=cache.hits - hits, cache_misses=cache.misses - misses)
+
+        # oceans (and areas the source has no tiles for) are read as 0s and
+        # shaded as a single value, so needn't be
+        if not data.any():
+            s["empty"] = True
+            empty_tiles.add(covered)
+
+            return [(t, empty_hillshade(add_slopeshade), hillshade_meta(t)) for t in covered]
+
+    n = 2**tile.z
+    tiles = []
+
+    if resample and RESAMPLING.get(tile.z, 1.0) != 1.0:
+        # the resampling grid is aligned to the window it's applied to, so
+        # each tile is resampled from its own buffered window (as when it's
+        # rendered alone) for metatiles to match single tiles
+        for t in covered:
+            top = BUFFER if t.y > 0 else 0
+            bottom = BUFFER if t.y < n - 1 else 0
+            left = BUFFER if t.x > 0 else 0
+            right = BUFFER if t.x < n - 1 else 0
+            row = top_buffer + DST_TILE_HEIGHT * (t.y - my)
+            col = left_buffer + DST_TILE_WIDTH * (t.x - mx)
+
+            hs = shade_window(data[row - top:row + DST_TILE_HEIGHT + bottom, col - left:col + DST_TILE_WIDTH + right],
+                              t, 1, top, arena, resample=True, add_slopeshade=add_slopeshade)
+            tiles.append((t, hs[top:top + DST_TILE_HEIGHT, left:left + DST_TILE_WIDTH], hillshade_meta(t)))
+
+        return tiles
+
+    hs = shade_window(data, Tile(mx, my, tile.z), height, top_buffer, arena, resample=resample,
+                      add_slopeshade=add_slopeshade)
+
+    for t in covered:
+        row = top_buffer + DST_TILE_HEIGHT * (t.y - my)
+        col = left_buffer + DST_TILE_WIDTH * (t.x - mx)
+
+        # slices the non-buffered part of the generated hillshade out
+        tiles.append((t, hs[row:row + DST_TILE_HEIGHT, col:col + DST_TILE_WIDTH], hillshade_meta(t)))
+
+    return tiles
+
+
+def shade_window(data, tile, height, top_buffer, arena, resample=True, add_slopeshade=True):
+    """
+    Scale (by latitude), resample (if *resample*) and shade *data*, a
+    buffered source window of *height* rows of tiles from *tile*'s (with
+    *top_buffer* rows above them), working in buffers from *arena* (a
+    Scratch), returning a uint8 array of its shape.
+    """
+    src = get_source()
+    shape = data.shape
+    mx, my = tile.x, tile.y
+
+    # conversion factor from SRC_TILE_ZOOM to the target image
+    scale = 2**(SRC_TILE_ZOOM - tile.z + SRC_TILE_WIDTH / DST_TILE_WIDTH - 1)
 
     # scale data
 
-    # interpolate latitudes
-    bounds = mercantile.bounds(tile.x, tile.y, tile.z)
-    height = data.shape[0]
-    latitudes = np.interp(np.arange(height), [top_buffer, height - bottom_buffer - 1], [bounds.north, bounds.south])
+    with span("latitude"):
+        # interpolate latitudes, linearly within each row of tiles
+        rows = []
+        latitudes = []
+        for j in range(height):
+            bounds = mercantile.bounds(mx, my + j, tile.z)
+            rows += [top_buffer + DST_TILE_HEIGHT * j, top_buffer + DST_TILE_HEIGHT * (j + 1) - 1]
+            latitudes += [bounds.north, bounds.south]
 
-    factors = 1 / np.cos(np.radians(latitudes))
+        latitudes = np.interp(np.arange(data.shape[0]), rows, latitudes)
 
-    # convert to 2d array, rotate 270º, scale data
-    data = data * np.rot90(np.atleast_2d(factors), 3)
+        factors = 1 / np.cos(np.radians(latitudes))
+
+        # convert to 2d array, rotate 270º, scale data (in float32; shading doesn't need more)
+        data = np.multiply(data, np.rot90(np.atleast_2d(factors.astype(np.float32)), 3),
+                           out=arena.get("elevation", shape, np.float32))
 
     resample_factor = RESAMPLING.get(tile.z, 1.0)
 
     if resample and resample_factor != 1.0:
         # resample data according to Tom Paterson's chart
 
-        aff = SRC.affine
+        aff = src.affine
         # this is the equivalent of a scale transform (I think)
         newaff = Affine(aff.a / resample_factor, aff.b, aff.c,
                         aff.d, aff.e / resample_factor, aff.f)
         # create an empty target array that's the shape of the resampled tile (e.g. 80% of 260x260px)
-        resampled = np.empty(shape=(round(data.shape[0] * resample_factor),
-                                 round(data.shape[1] * resample_factor)),
-                             dtype=data.dtype)
-
-        # downsample using GDAL's reprojection functionality (which gives us access to different resampling algorithms)
-        reproject(
-            data,
-            resampled,
-            src_transform=SRC.affine,
-            dst_transform=newaff,
-            src_crs=SRC.crs,
-            dst_crs=SRC.crs,
-            # resampling=Resampling.bilinear,
-            resampling=1,
-        )
+        resampled = arena.get("resampled", (int(round(data.shape[0] * resample_factor)),
+                                            int(round(data.shape[1] * resample_factor))), data.dtype)
+
+        # downsample (bilinearly, as GDAL's reproject() would, but with cached weights)
+        with span("downsample"):
+            resample_bilinear(data, resampled, 1 / resample_factor, arena=arena)
 
         dx = newaff.a * scale
         dy = newaff.e * scale
 
-        hs = hillshade(resampled,
-            dx=dx,
-            dy=dy,
-            vert_exag=EXAGGERATION.get(tile.z, 1.0),
-            # azdeg=315, # which direction is the light source coming from (north-south)
-            # altdeg=45, # what angle is the light source coming from (overhead-horizon)
-        )
-
-        if add_slopeshade:
-            ss = slopeshade(resampled,
+        # hillshade * slopeshade, scaled to integers (0-255)
+        with span("shade"):
+            hs = shade(resampled,
                 dx=dx,
                 dy=dy,
-                vert_exag=EXAGGERATION.get(tile.z, 1.0)
+                vert_exag=EXAGGERATION.get(tile.z, 1.0),
+                # azdeg=315, # which direction is the light source coming from (north-south)
+                # altdeg=45, # what angle is the light source coming from (overhead-horizon)
+                add_slopeshade=add_slopeshade,
+                out=arena.get("shaded", resampled.shape, np.uint8),
+                scratch=shade_scratch(arena, resampled.shape),
+                workers=SHADE_WORKERS,
+                pool=get_shade_pool(),
             )
 
-            hs *= ss
-
-        # scale hillshade values (0.0-1.0) to integers (0-255)
-        hs = (255.0 * hs).astype(np.uint8)
-
         # create an empty target array that's the shape of the target tile + buffers (e.g. 260x260px)
         resampled_hs = np.empty(shape=data.shape, dtype=hs.dtype)
 
-        # upsample (invert the previous reprojection)
-        reproject(
-            hs,
-            resampled_hs,
-            src_transform=newaff,
-            dst_transform=SRC.affine,
-            src_crs=SRC.crs,
-            dst_crs=SRC.crs,
-            # resampling=Resampling.bilinear,
-            resampling=1,
-        )
+        # upsample (invert the previous resampling)
+        with span("upsample"):
+            resample_bilinear(hs, resampled_hs, resample_factor, arena=arena)
 
         hs = resampled_hs
     else:
-        dx = SRC.affine.a * scale
-        dy = SRC.affine.e * scale
-
-        hs = hillshade(data,
-            dx=dx,
-            dy=dy,
-            vert_exag=EXAGGERATION.get(tile.z, 1.0),
-            # azdeg=315, # which direction is the light source coming from (north-south)
-            # altdeg=45, # what angle is the light source coming from (overhead-horizon)
-        )
-
-        if add_slopeshade:
-            ss = slopeshade(data,
+        dx = src.affine.a * scale
+        dy = src.affine.e * scale
+
+        # hillshade * slopeshade, scaled to integers (0-255)
+        with span("shade"):
+            hs = shade(data,
                 dx=dx,
                 dy=dy,
-                vert_exag=EXAGGERATION.get(tile.z, 1.0)
+                vert_exag=EXAGGERATION.get(tile.z, 1.0),
+                # azdeg=315, # which direction is the light source coming from (north-south)
+                # altdeg=45, # what angle is the light source coming from (overhead-horizon)
+                add_slopeshade=add_slopeshade,
+                scratch=shade_scratch(arena, data.shape),
+                workers=SHADE_WORKERS,
+                pool=get_shade_pool(),
             )
 
-            # hs *= 0.8
-            hs *= ss
+    return hs
+
+
+def shade_scratch(arena, shape):
+    return tuple(arena.get("shade{}".format(i), shape, np.float32) for i in range(3))
+
+
+def hillshade_meta(tile):
+    """
+    Return the metadata (size, georeferencing, etc.) of *tile*'s hillshade.
+    """
+    dz = SRC_TILE_ZOOM - tile.z
+    scale = 2**(dz + SRC_TILE_WIDTH / DST_TILE_WIDTH - 1)
 
-        # scale hillshade values (0.0-1.0) to integers (0-255)
-        hs = (255.0 * hs).astype(np.uint8)
+    # window is measured in pixels at SRC_TILE_ZOOM
+    window = [
+              [
+               SRC_TILE_HEIGHT * 2**dz * tile.y,
+               SRC_TILE_HEIGHT * 2**dz * (tile.y + 1)
+              ],
+              [
+               SRC_TILE_WIDTH * 2**dz * tile.x,
+               SRC_TILE_WIDTH * 2**dz * (tile.x + 1)
+              ]
+             ]
 
-    src_meta.update(SRC.meta.copy())
-    del src_meta["transform"]
-    src_meta.update(dict(
+    src = get_source()
+    meta = src.meta.copy()
+    del meta["transform"]
+    meta.update(dict(
         height=DST_TILE_HEIGHT,
         width=DST_TILE_WIDTH,
-        affine=SRC.window_transform(window) * Affine.scale(scale)
+        affine=src.window_transform(window) * Affine.scale(scale)
     ))
 
-    # slices the non-buffered part of the generated hillshade out and returns it
-    return hs[left_buffer:hs.shape[0] - right_buffer, top_buffer:hs.shape[1] - bottom_buffer]
+    return meta
 
 
-def save_hillshade(tile, data, meta):
-    s3 = boto3.resource("s3")
+def hillshade_key(tile):
+    return "3857/{}/{}/{}.tif".format(tile.z, tile.x, tile.y)
+
+
+def encode_hillshade(data, meta):
+    """
+    Encode a hillshade as a tiled, deflated GeoTIFF and return its bytes.
+    """
     meta.update(
         driver="GTiff",
         dtype=rasterio.uint8,
@@ -264,28 +811,78 @@ def save_hillshade(tile, data, meta):
         predictor=1,
         nodata=None,
         tiled=True,
-        sparse_ok=True,
         blockxsize=DST_BLOCK_SIZE,
         blockysize=DST_BLOCK_SIZE,
     )
 
-    with rasterio.open(TMP_PATH, "w", **meta) as tmp:
-        tmp.write(data, 1)
+    with span("tif_encode") as s:
+        # one per thread, as hillshades may be encoded concurrently
+        path = "{}-{}".format(TMP_PATH, threading.current_thread().ident)
 
-    key = "3857/{}/{}/{}.tif".format(tile.z, tile.x, tile.y)
+        with rasterio.open(path, "w", **meta) as tmp:
+            tmp.write(data, 1)
 
-    s3.Object(
-        S3_BUCKET,
-        key,
-    ).put(
-        Body=bytes(bytearray(virtual_file_to_buffer(TMP_PATH))),
+        body = bytes(bytearray(virtual_file_to_buffer(path)))
+        s["bytes"] = len(body)
+
+    return body
+
+
+def hillshade_object(tile, data, meta):
+    """
+    Return the put_object() arguments that store *tile*'s hillshade.
+    """
+    return dict(
+        Bucket=S3_BUCKET,
+        Key=hillshade_key(tile),
+        Body=encode_hillshade(data, meta),
         ACL="public-read",
         ContentType="image/tiff",
         CacheControl="public, max-age=2592000",
         StorageClass="REDUCED_REDUNDANCY",
     )
 
-    return "http://{}.s3.amazonaws.com/{}".format(S3_BUCKET, key)
+
+def hillshade_url(tile):
+    return get_store().url(hillshade_key(tile))
+
+
+def save_hillshade(tile, data, meta):
+    [location] = put_objects([hillshade_object(tile, data, meta)])
+
+    return location
+
+
+def save_hillshades(tiles):
+    """
+    Store a list of (tile, data, meta) concurrently, returning their URLs.
+    """
+    return put_objects([hillshade_object(t, data=data, meta=meta) for t, data, meta in tiles])
+
+
+def save_leased_hillshades(tiles, lease):
+    """
+    Store a list of (tile, data, meta) as save_hillshades() does, then
+    release *lease*, marking it completed if they were all stored.
+    """
+    try:
+        save_hillshades(tiles)
+    except Exception:
+        lease.release(completed=False)
+        raise
+
+    lease.release()
+
+
+def downsample(data, factor=2):
+    """
+    Reduce a 2d uint8 array by averaging (and rounding) factor x factor
+    pixel blocks.
+    """
+    height, width = data.shape
+    blocks = data.reshape(height // factor, factor, width // factor, factor).sum(axis=(1, 3), dtype=np.uint32)
+
+    return ((blocks + factor**2 // 2) // factor**2).astype(np.uint8)
 
 
 def hillshade(elevation, azdeg=315, altdeg=45, vert_exag=1, dx=1, dy=1, fraction=1.):
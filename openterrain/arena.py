@@ -0,0 +1,119 @@
+# coding=utf-8
+"""
+Scratch buffers reused from one render to the next, so that a warm process
+doesn't allocate (and fault in) several MB of temporaries per tile.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+
+import numpy as np
+
+
+class Arena(object):
+    """
+    Scratch arrays keyed by name, shape and dtype, shared by every thread in
+    the process. Renders check buffers out for their duration (see
+    checkout()); once they're returned, up to *max_size* bytes of them are
+    kept in total (least recently used first out), and larger arrays aren't
+    kept at all.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.reuses = 0
+        self.allocations = 0
+        # key -> [buffers]
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return dict(reuses=self.reuses, allocations=self.allocations, size=self.size,
+                        buffers=sum(len(buffers) for buffers in self._buffers.values()))
+
+    @contextmanager
+    def checkout(self):
+        """
+        Yield a Scratch to take buffers from, returning them to the arena
+        afterwards.
+        """
+        scratch = Scratch(self)
+
+        try:
+            yield scratch
+        finally:
+            self._put(scratch.release())
+
+    def _take(self, key):
+        with self._lock:
+            buffers = self._buffers.get(key)
+
+            if not buffers:
+                self.allocations += 1
+                return None
+
+            buf = buffers.pop()
+            self.size -= buf.nbytes
+            self.reuses += 1
+
+            if not buffers:
+                del self._buffers[key]
+
+            return buf
+
+    def _put(self, buffers):
+        with self._lock:
+            for key, buf in buffers:
+                if buf.nbytes > self.max_size:
+                    continue
+
+                # re-insert as the most recently used
+                self._buffers[key] = self._buffers.pop(key, []) + [buf]
+                self.size += buf.nbytes
+
+            while self.size > self.max_size:
+                key, evicted = next(iter(self._buffers.items()))
+                self.size -= evicted.pop(0).nbytes
+
+                if not evicted:
+                    del self._buffers[key]
+
+
+class Scratch(object):
+    """
+    Buffers checked out of an Arena by a single thread. Buffers are only
+    valid until the same name, shape and dtype are asked for again, so
+    nothing that's returned to callers may live in them.
+    """
+
+    def __init__(self, arena):
+        self.arena = arena
+        self._taken = {}
+
+    def get(self, name, shape, dtype):
+        """
+        Return an uninitialized array of *shape* and *dtype*.
+        """
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        buf = self._taken.get(key)
+
+        if buf is None:
+            buf = self.arena._take(key)
+
+            if buf is None:
+                buf = np.empty(shape, dtype=dtype)
+
+            self._taken[key] = buf
+
+        return buf
+
+    def release(self):
+        """
+        Return the list of (key, buffer) checked out.
+        """
+        taken, self._taken = list(self._taken.items()), {}
+
+        return taken
@@ -0,0 +1,187 @@
+# coding=utf-8
+"""
+Rendering many tiles in a single invocation.
+
+A batch is either a list of tiles:
+
+    {"tiles": ["12/654/1582", "12/655/1582", ...]}
+
+or a range of them (inclusive):
+
+    {"zoom": 12, "x": [654, 657], "y": [1580, 1583]}
+
+Tiles are grouped by the metatile containing them, so that each group is
+rendered from a single source read, and groups are processed on a small
+thread pool so that one group's S3 requests overlap with another's
+rendering. No new groups are started once the invocation is close to
+running out of time; their tiles are returned as "skipped" so that they
+can be resubmitted.
+"""
+
+from collections import OrderedDict
+import os
+import sys
+import time
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from openterrain import MAX_ZOOM, metatile_bounds, METATILE_SIZE, Tile
+from openterrain import timing
+from openterrain.startup import lazy
+
+
+# most tiles accepted in a batch
+MAX_BATCH_SIZE = 1024
+
+# groups processed at once
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 3))
+
+# time (in ms) to leave when deciding whether to start another group, in
+# addition to the time groups have been taking
+BATCH_TIME_MARGIN = int(os.environ.get("BATCH_TIME_MARGIN", 1000))
+
+
+@lazy
+def get_batch_pool():
+    from multiprocessing.pool import ThreadPool
+
+    return ThreadPool(BATCH_CONCURRENCY)
+
+
+def tile_name(tile):
+    return "{}/{}/{}".format(tile.z, tile.x, tile.y)
+
+
+def parse_tiles(batch):
+    """
+    Return the (distinct) tiles in a batch, in order, validating them
+    (raising ValueError if it's invalid).
+    """
+    if not isinstance(batch, dict):
+        raise ValueError("Invalid batch")
+
+    if "tiles" in batch:
+        if not isinstance(batch["tiles"], list):
+            raise ValueError("Invalid batch")
+
+        tiles = []
+
+        for name in batch["tiles"]:
+            try:
+                z, x, y = [int(n) for n in name.split("/")]
+            except (AttributeError, ValueError):
+                raise ValueError("Invalid tile: {}".format(name))
+
+            tiles.append(Tile(x, y, z))
+    elif "zoom" in batch:
+        try:
+            zoom = int(batch["zoom"])
+            (min_x, max_x), (min_y, max_y) = [[int(n) for n in batch[axis]] for axis in ("x", "y")]
+        except (KeyError, OverflowError, TypeError, ValueError):
+            raise ValueError("Invalid batch")
+
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > MAX_BATCH_SIZE:
+            raise ValueError("Invalid batch size")
+
+        tiles = [Tile(x, y, zoom) for y in range(min_y, max_y + 1) for x in range(min_x, max_x + 1)]
+    else:
+        raise ValueError("Invalid batch")
+
+    tiles = list(OrderedDict.fromkeys(tiles))
+
+    if not 0 < len(tiles) <= MAX_BATCH_SIZE:
+        raise ValueError("Invalid batch size")
+
+    for tile in tiles:
+        if not 0 <= tile.z <= MAX_ZOOM:
+            raise ValueError("Invalid zoom")
+
+        if not (0 <= tile.x < 2**tile.z and 0 <= tile.y < 2**tile.z):
+            raise ValueError("Invalid coordinates")
+
+    return tiles
+
+
+def group_tiles(tiles, size=METATILE_SIZE):
+    """
+    Group tiles by the metatile of *size* containing them, returning a list
+    of lists of tiles.
+    """
+    groups = OrderedDict()
+
+    for tile in tiles:
+        groups.setdefault((tile.z,) + metatile_bounds(tile, size), []).append(tile)
+
+    return list(groups.values())
+
+
+def remaining_ms(context):
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+
+    return context.get_remaining_time_in_millis()
+
+
+def run(groups, fn, context=None, on_error=None, concurrency=BATCH_CONCURRENCY, margin=BATCH_TIME_MARGIN):
+    """
+    Call fn(group) for each group of tiles, *concurrency* at a time. fn
+    returns a dict of locations keyed by tile.
+
+    Returns {"locations": {...}, "errors": {...}, "skipped": [...]}, keyed
+    by tile name. If fn raises, every tile in its group gets the error (and
+    on_error is called with its exc_info). Groups aren't started once
+    *context* (a Lambda context) has less than *margin* ms, plus the
+    slowest group so far, remaining.
+    """
+    pool = get_batch_pool()
+    done = Queue()
+    request = timing.current()
+    result = {"locations": {}, "errors": {}, "skipped": []}
+    slowest = 0
+    pending = 0
+
+    def process(group):
+        start = time.time()
+
+        try:
+            with timing.attach(request):
+                done.put((group, fn(group), None, time.time() - start))
+        except Exception:
+            done.put((group, None, sys.exc_info(), time.time() - start))
+
+    def collect():
+        group, locations, exc_info, elapsed = done.get()
+
+        if exc_info is not None:
+            for tile in group:
+                result["errors"][tile_name(tile)] = "{}: {}".format(exc_info[0].__name__, exc_info[1])
+
+            if on_error is not None:
+                on_error(exc_info)
+        else:
+            for tile, location in locations.items():
+                result["locations"][tile_name(tile)] = location
+
+        return elapsed
+
+    for i, group in enumerate(groups):
+        if pending >= concurrency:
+            slowest = max(slowest, collect())
+            pending -= 1
+
+        remaining = remaining_ms(context)
+        if remaining is not None and remaining < margin + slowest * 1000:
+            result["skipped"] = [tile_name(tile) for g in groups[i:] for tile in g]
+            break
+
+        pool.apply_async(process, (group,))
+        pending += 1
+
+    while pending:
+        collect()
+        pending -= 1
+
+    return result
@@ -0,0 +1,112 @@
+# coding=utf-8
+"""
+In-process caches, shared between threads.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    A mapping that evicts its least recently used entries once the total
+    size of its values exceeds *max_size* (bytes, as measured by *sizeof*).
+    """
+
+    def __init__(self, max_size, sizeof=lambda value: value.nbytes):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=self.size,
+                    entries=len(self))
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            # re-insert as the most recently used
+            self._entries[key] = (value, size)
+            self.hits += 1
+
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+            if size > self.max_size:
+                return
+
+            self._entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+
+class ExpiringSet(object):
+    """
+    A set whose members are forgotten *ttl* seconds after being added. At
+    most *max_entries* are kept; the oldest are dropped first.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._expires = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            expires = self._expires.get(key)
+
+            if expires is None:
+                return False
+
+            if expires < time.time():
+                del self._expires[key]
+                return False
+
+            return True
+
+    def add(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+            self._expires[key] = time.time() + self.ttl
+
+            while len(self._expires) > self.max_entries:
+                self._expires.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
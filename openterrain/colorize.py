@@ -0,0 +1,231 @@
+# coding=utf-8
+"""
+Colorize uint8 hillshades with precomputed lookup tables.
+
+compile_ramp() turns a matplotlib-style segment ramp (as passed to
+LinearSegmentedColormap) into a 256x4 uint8 RGBA table indexed directly by
+hillshade value, producing the same colors as
+
+    plt.imsave(out, data, cmap=LinearSegmentedColormap(name, ramp), vmin=0, vmax=255)
+
+without importing matplotlib.
+
+Since every color is a function of a single byte, PNGs are written as 8-bit
+palette images (the table as PLTE, its alpha as tRNS), a quarter of the
+pixel data of RGBA with the same colors, and compressed at
+PNG_COMPRESS_LEVEL. Tiles can also be encoded as WebP, where Pillow supports
+it (see get_formats()).
+"""
+
+import os
+from StringIO import StringIO
+
+import numpy as np
+from PIL import Image
+
+from openterrain import downsample
+from openterrain.startup import lazy
+from openterrain.timing import span
+
+
+# number of colors in the (matplotlib) colormap
+N = 256
+
+# hillshades are rendered as 512px (@2x) tiles
+RENDER_SCALE = 2
+
+# zlib level for PNGs: 1 is fastest, 9 smallest
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", 6))
+
+# write palette PNGs rather than RGBA
+PNG_PALETTE = os.environ.get("PNG_PALETTE", "true").lower() in ("1", "true", "yes")
+
+# lossy WebP quality (0-100), unless WEBP_LOSSLESS
+WEBP_QUALITY = int(os.environ.get("WEBP_QUALITY", 80))
+WEBP_LOSSLESS = os.environ.get("WEBP_LOSSLESS", "").lower() in ("1", "true", "yes")
+
+# formats tiles can be encoded as, where Pillow supports them
+FORMATS = ("png", "webp")
+
+
+def _lookup_table(segments, n=N):
+    """
+    Equivalent to matplotlib.colors.makeMappingArray(n, segments): a
+    piecewise linear mapping of n evenly spaced points in [0, 1] through the
+    (x, y0, y1) anchors in *segments*.
+    """
+    segments = np.array(segments, dtype=np.float64)
+    x = segments[:, 0] * (n - 1)
+    y0 = segments[:, 1]
+    y1 = segments[:, 2]
+
+    xind = (n - 1) * np.linspace(0, 1, n)
+    ind = np.searchsorted(x, xind)[1:-1]
+
+    distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+    lut = np.concatenate([
+        [y1[0]],
+        distance * (y0[ind] - y1[ind - 1]) + y1[ind - 1],
+        [y0[-1]],
+    ])
+
+    return np.clip(lut, 0.0, 1.0)
+
+
+def compile_ramp(ramp):
+    """
+    Compile a ramp ({"red": [...], "green": [...], "blue": [...], and
+    optionally "alpha": [...]}) into a 256x4 uint8 RGBA table indexed by
+    hillshade value.
+    """
+    colors = np.ones((N, 4), dtype=np.float64)
+
+    for i, channel in enumerate(("red", "green", "blue", "alpha")):
+        if channel in ramp:
+            colors[:, i] = _lookup_table(ramp[channel])
+
+    # map values 0-255 to colormap entries as Normalize(vmin=0, vmax=255) +
+    # Colormap.__call__ do, then convert to bytes by truncation
+    values = np.arange(256, dtype=np.float32) / np.float32(255)
+    index = np.minimum((values * N).astype(int), N - 1)
+
+    return (colors[index] * 255).astype(np.uint8)
+
+
+def colorize(data, lut):
+    """
+    Apply a compiled ramp to a 2d uint8 array, returning an (h, w, 4) RGBA
+    array.
+    """
+    return lut[data]
+
+
+def compile_palette(lut):
+    """
+    Return (index, colors) for a compiled ramp: its distinct colors (an
+    (n, 4) RGBA array) and a 256-entry uint8 table mapping hillshade values
+    to them. Ramps that map runs of values to the same color (e.g. fully
+    transparent ones) compress much better once those are merged.
+    """
+    colors, index = np.unique(np.ascontiguousarray(lut).view(np.uint32).ravel(), return_inverse=True)
+
+    return index.astype(np.uint8), colors.view(np.uint8).reshape(-1, 4)
+
+
+def encode_png(data, lut, compress_level=None, palette=None):
+    """
+    Colorize a 2d uint8 array and return it encoded as a PNG: an 8-bit
+    palette image (unless not *palette*, or PNG_PALETTE is off), or RGBA.
+    """
+    if compress_level is None:
+        compress_level = PNG_COMPRESS_LEVEL
+
+    if palette is None:
+        palette = PNG_PALETTE
+
+    with span("png_encode") as s:
+        out = StringIO()
+
+        if palette:
+            index, colors = compile_palette(lut)
+            image = Image.fromarray(index[data], "L")
+            image.putpalette(colors[:, :3].tobytes())
+            options = {}
+
+            # trailing opaque entries can be left out of tRNS, and it can be
+            # left out altogether if every entry is
+            translucent = np.flatnonzero(colors[:, 3] != 255)
+            if len(translucent) > 0:
+                options["transparency"] = colors[:translucent[-1] + 1, 3].tobytes()
+
+            image.save(out, "png", compress_level=compress_level, **options)
+        else:
+            Image.fromarray(colorize(data, lut), "RGBA").save(out, "png", compress_level=compress_level)
+
+        s["bytes"] = out.tell()
+
+    return out.getvalue()
+
+
+def encode_webp(data, lut, quality=None, lossless=None):
+    """
+    Colorize a 2d uint8 array and return it encoded as an RGBA WebP, at
+    *quality* (default WEBP_QUALITY) or *lossless* (default WEBP_LOSSLESS).
+    """
+    if quality is None:
+        quality = WEBP_QUALITY
+
+    if lossless is None:
+        lossless = WEBP_LOSSLESS
+
+    with span("webp_encode") as s:
+        out = StringIO()
+        Image.fromarray(colorize(data, lut), "RGBA").save(out, "webp", quality=quality, lossless=lossless)
+
+        s["bytes"] = out.tell()
+
+    return out.getvalue()
+
+
+@lazy
+def get_formats():
+    """
+    Return the FORMATS that Pillow can write (checked on first use rather
+    than at import, as loading its plugins slows cold starts).
+    """
+    try:
+        from PIL import features
+    except ImportError:
+        # Pillow < 3.4
+        Image.init()
+        return tuple(format for format in FORMATS if format.upper() in Image.SAVE)
+
+    return tuple(format for format in FORMATS if format == "png" or features.check(format))
+
+
+ENCODERS = {
+    "png": encode_png,
+    "webp": encode_webp,
+}
+
+# encoded tiles of a single value (e.g. oceans), keyed by (table, value,
+# shape, scales, format)
+_constant_tiles = {}
+
+
+def encode_tiles(data, lut, scales=(2, 1), format="png"):
+    """
+    Encode a 2d uint8 hillshade as *format* (one of get_formats()) at each of
+    *scales*, returning a list of (scale, bytes). Smaller scales are
+    box-filtered from the hillshade itself before colorizing, rather than
+    resampled from the encoded image. Tiles of a single value are encoded
+    once and reused.
+    """
+    if format not in get_formats():
+        raise Exception("Invalid format")
+
+    if data.min() == data.max():
+        # single-valued tiles (e.g. oceans) encode the same wherever they
+        # are, so each value is only encoded once per table
+        key = (lut.tobytes(), int(data.flat[0]), data.shape, tuple(scales), format)
+        tiles = _constant_tiles.get(key)
+
+        if tiles is None:
+            tiles = _constant_tiles[key] = _encode_tiles(data, lut, scales, format)
+
+        return list(tiles)
+
+    return _encode_tiles(data, lut, scales, format)
+
+
+def _encode_tiles(data, lut, scales, format):
+    encode = ENCODERS[format]
+    tiles = []
+
+    for scale in scales:
+        if scale == RENDER_SCALE:
+            tiles.append((scale, encode(data, lut)))
+        else:
+            tiles.append((scale, encode(downsample(data, factor=RENDER_SCALE // scale), lut)))
+
+    return tiles
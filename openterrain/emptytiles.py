@@ -0,0 +1,141 @@
+# coding=utf-8
+"""
+An index of the tiles known to be empty: those whose (buffered) source
+windows are entirely 0 (oceans, and wherever the elevation source has no
+tiles, which mapzen.xml reads as 0), so that their hillshades are a single
+value. They're returned without reading the source, rendering or fetching
+them.
+
+Tiles are kept as bitmaps of BLOCK_SIZE x BLOCK_SIZE tiles at each zoom (a
+bit per tile, only for blocks with any empty tiles). Given a *path* (which
+should be local to the host), they're also appended to it as 5-byte
+records, and other processes using the same file pick them up as they go.
+It's a cache: delete it when the elevation source changes.
+"""
+
+import errno
+import os
+import struct
+import threading
+
+
+# tiles along each side of a bitmap
+BLOCK_SIZE = 64
+
+# zoom, x, y
+RECORD = struct.Struct("<BHH")
+
+
+class EmptyTiles(object):
+    """
+    A set of Tiles, optionally shared through the file at *path*.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.count = 0
+        self._blocks = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._load()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, tile):
+        with self._lock:
+            if self._get(tile.z, tile.x, tile.y):
+                return True
+
+            if self.path is None or self._size() <= self._offset:
+                return False
+
+            # another process may have found it
+            self._load()
+
+            return self._get(tile.z, tile.x, tile.y)
+
+    def stats(self):
+        return dict(tiles=self.count, blocks=len(self._blocks))
+
+    def add(self, tiles):
+        """
+        Record that *tiles* are empty.
+        """
+        with self._lock:
+            new = [t for t in tiles if self._set(t.z, t.x, t.y)]
+
+            if not new or self.path is None:
+                return
+
+            # appends of whole records don't interleave with other processes'
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+            try:
+                os.write(fd, b"".join(RECORD.pack(t.z, t.x, t.y) for t in new))
+            finally:
+                os.close(fd)
+
+    def _bit(self, z, x, y):
+        i = (y % BLOCK_SIZE) * BLOCK_SIZE + x % BLOCK_SIZE
+
+        return (z, x // BLOCK_SIZE, y // BLOCK_SIZE), i >> 3, 1 << (i & 7)
+
+    def _get(self, z, x, y):
+        key, offset, mask = self._bit(z, x, y)
+        block = self._blocks.get(key)
+
+        return block is not None and bool(block[offset] & mask)
+
+    def _set(self, z, x, y):
+        """
+        Set a tile's bit, returning False if it was already set.
+        """
+        key, offset, mask = self._bit(z, x, y)
+        block = self._blocks.get(key)
+
+        if block is None:
+            block = self._blocks[key] = bytearray(BLOCK_SIZE * BLOCK_SIZE // 8)
+        elif block[offset] & mask:
+            return False
+
+        block[offset] |= mask
+        self.count += 1
+
+        return True
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return 0
+
+            raise
+
+    def _load(self):
+        """
+        Read the records appended to *path* since it was last read.
+        """
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT:
+                return
+
+            raise
+
+        # leave a partly written record for next time
+        end = len(data) - len(data) % RECORD.size
+
+        for i in range(0, end, RECORD.size):
+            self._set(*RECORD.unpack_from(data, i))
+
+        self._offset += end
@@ -0,0 +1,263 @@
+# coding=utf-8
+"""
+Work out which rendered tiles are stale after the elevation source changes
+(or rendering is tuned for some zooms), as compact ranges of tiles:
+
+    python -m openterrain.invalidate --source-tiles 10/163/395 10/164/395
+    python -m openterrain.invalidate --zooms 12 --bbox -123.0 37.0 -121.5 38.5 --format batches
+    python -m openterrain.invalidate --source-tiles 10/163/395 --format messages
+    python -m openterrain.invalidate --zooms 12 --overviews 11
+
+A changed source tile marks its area as changed at every zoom (upstream
+pyramids are rebuilt from the same data). A tile is stale if its area,
+grown by the BUFFER pixels that are read around it, overlaps a changed
+area: each tile is rendered from its own buffered window, whatever the size
+of the metatile it was rendered in (and a metatile of zeros renders as
+zeros would). Tiles derived from their children (seed --overviews) are
+covered by the same rule. A changed zoom makes every tile at that zoom
+(within *bbox*) stale, and with --overviews Z (as passed to seed), so are
+the tiles derived from them at the zooms up to Z.
+
+The tiles known to be empty (EMPTY_TILE_INDEX) aren't rendered at all, so
+after the elevation source changes, the index should be deleted on each
+host (and the processes using it restarted) before stale tiles are
+re-rendered.
+
+Ranges are {"zoom": z, "x": [min, max], "y": [min, max]} (inclusive), as
+in openterrain.batch, so they can be submitted for re-rendering as they
+are (--format batches splits them into batch-sized pieces), or expanded
+into the keys to delete (--format keys), or into JSON messages for
+functions/tile-remover (--format messages), each with the bucket its key
+is in: the style's, or --bucket (S3_BUCKET by default) for hillshades and
+styles without their own.
+"""
+
+import argparse
+import json
+import math
+import sys
+
+import mercantile
+
+from openterrain import (BUFFER, DST_TILE_WIDTH, hillshade_key, MAX_ZOOM, S3_BUCKET, SRC_TILE_WIDTH, SRC_TILE_ZOOM,
+                         Tile)
+from openterrain.batch import MAX_BATCH_SIZE
+from openterrain.colorize import FORMATS
+from openterrain.styles import STYLES
+
+
+def style_keys(styles=list(STYLES), formats=("png",), bucket=S3_BUCKET):
+    """
+    Return (bucket, template) pairs for the keys of *styles*' tiles (at both
+    scales, in each of *formats*), in the style's bucket or *bucket*.
+    """
+    return [(STYLES[name].get("bucket", bucket),
+             "{}/{{z}}/{{x}}/{{y}}{}.{}".format(STYLES[name].get("prefix", name), scale, format))
+            for name in styles for format in formats for scale in ("", "@2x")]
+
+
+def source_area(z, x, y):
+    """
+    Return the (left, top, right, bottom) of a source tile, in pixels at
+    SRC_TILE_ZOOM.
+    """
+    size = SRC_TILE_WIDTH * 2.0**(SRC_TILE_ZOOM - z)
+
+    return x * size, y * size, (x + 1) * size, (y + 1) * size
+
+
+def bbox_area(bbox):
+    """
+    Return the (left, top, right, bottom) of a (west, south, east, north)
+    bounding box, in pixels at SRC_TILE_ZOOM.
+    """
+    west, south, east, north = bbox
+    ul = mercantile.tile(west, north, SRC_TILE_ZOOM)
+    lr = mercantile.tile(east, south, SRC_TILE_ZOOM)
+
+    return source_area(SRC_TILE_ZOOM, ul.x, ul.y)[:2] + source_area(SRC_TILE_ZOOM, lr.x, lr.y)[2:]
+
+
+def affected_tiles(area, zoom, halo=BUFFER):
+    """
+    Return the (min_x, min_y, max_x, max_y) of the tiles at *zoom* whose
+    areas grown by *halo* pixels (at zoom) overlap *area*, or None.
+    """
+    size = SRC_TILE_WIDTH * 2.0**(SRC_TILE_ZOOM - zoom)
+    margin = halo * size / DST_TILE_WIDTH
+    left, top, right, bottom = area
+    n = 2**zoom
+
+    bounds = (max(int(math.floor((left - margin) / size)), 0),
+              max(int(math.floor((top - margin) / size)), 0),
+              min(int(math.ceil((right + margin) / size)) - 1, n - 1),
+              min(int(math.ceil((bottom + margin) / size)) - 1, n - 1))
+
+    if bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+        return None
+
+    return bounds
+
+
+def merge(rects):
+    """
+    Return the union of (min_x, min_y, max_x, max_y) rectangles (inclusive)
+    as a list of non-overlapping ones, merging rows of tiles with the same
+    extent.
+    """
+    # sweep down the distinct bands of rows between rectangles' edges
+    edges = sorted(set([r[1] for r in rects] + [r[3] + 1 for r in rects]))
+    merged = []
+    previous = None
+
+    for top, bottom in zip(edges, edges[1:]):
+        spans = sorted((r[0], r[2]) for r in rects if r[1] <= top and bottom - 1 <= r[3])
+        columns = []
+
+        for min_x, max_x in spans:
+            if columns and min_x <= columns[-1][1] + 1:
+                columns[-1][1] = max(columns[-1][1], max_x)
+            else:
+                columns.append([min_x, max_x])
+
+        if previous is not None and previous[0] == columns and previous[2] == top:
+            # extend the previous band's rectangles
+            previous[2] = bottom
+        else:
+            previous = [columns, top, bottom]
+            merged.append(previous)
+
+    return [(min_x, top, max_x, bottom - 1) for columns, top, bottom in merged for min_x, max_x in columns]
+
+
+def plan(source_tiles=(), zooms=(), bbox=None, min_zoom=0, max_zoom=MAX_ZOOM, halo=BUFFER, overviews=None):
+    """
+    Return ranges of the tiles from min_zoom to max_zoom made stale by
+    changes to *source_tiles* (Tiles) and to rendering at *zooms* (within
+    *bbox*), ordered by zoom. With *overviews*, tiles at zooms up to it are
+    derived from their children (see seed), and so are stale wherever their
+    children are.
+    """
+    areas = [source_area(t.z, t.x, t.y) for t in source_tiles]
+    ranges = []
+    children = []
+
+    # from the bottom of the pyramid up, as derived tiles depend on their children (at any zoom)
+    for zoom in range(MAX_ZOOM, min_zoom - 1, -1):
+        rects = [affected_tiles(area, zoom, halo) for area in areas]
+
+        if zoom in zooms:
+            if bbox is not None:
+                rects.append(affected_tiles(bbox_area(bbox), zoom, halo=0))
+            else:
+                rects.append((0, 0, 2**zoom - 1, 2**zoom - 1))
+
+        if overviews is not None and zoom <= overviews and zoom < MAX_ZOOM:
+            rects += [(min_x // 2, min_y // 2, max_x // 2, max_y // 2) for min_x, min_y, max_x, max_y in children]
+
+        children = merge([r for r in rects if r is not None])
+
+        if zoom <= max_zoom:
+            ranges[:0] = [{"zoom": zoom, "x": [min_x, max_x], "y": [min_y, max_y]}
+                          for min_x, min_y, max_x, max_y in children]
+
+    return ranges
+
+
+def size(r):
+    return (r["x"][1] - r["x"][0] + 1) * (r["y"][1] - r["y"][0] + 1)
+
+
+def batches(ranges, max_size=MAX_BATCH_SIZE):
+    """
+    Split ranges into ranges of at most *max_size* tiles (blocks of whole
+    rows where possible).
+    """
+    for r in ranges:
+        (min_x, max_x), (min_y, max_y) = r["x"], r["y"]
+        width = min(max_x - min_x + 1, max_size)
+        rows = max(max_size // width, 1)
+
+        for x in range(min_x, max_x + 1, width):
+            for y in range(min_y, max_y + 1, rows):
+                yield {"zoom": r["zoom"], "x": [x, min(x + width - 1, max_x)], "y": [y, min(y + rows - 1, max_y)]}
+
+
+def keys(ranges, templates=style_keys(), hillshades=True, bucket=S3_BUCKET):
+    """
+    Generate the (bucket, key) of the tiles in *ranges*: their hillshades'
+    (in *bucket*, unless not *hillshades*) and each of *templates* ((bucket,
+    template) pairs, see style_keys()) formatted with z, x and y.
+    """
+    for r in ranges:
+        for y in range(r["y"][0], r["y"][1] + 1):
+            for x in range(r["x"][0], r["x"][1] + 1):
+                if hillshades:
+                    yield bucket, hillshade_key(Tile(x, y, r["zoom"]))
+
+                for template_bucket, template in templates:
+                    yield template_bucket, template.format(z=r["zoom"], x=x, y=y)
+
+
+def parse_tile(name):
+    z, x, y = [int(n) for n in name.split("/")]
+
+    return Tile(x, y, z)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List the tiles made stale by changes to the elevation source "
+                                                 "or rendering")
+    parser.add_argument("--source-tiles", nargs="*", default=[], metavar="Z/X/Y", type=parse_tile,
+                        help="changed source tiles")
+    parser.add_argument("--zooms", nargs="*", default=[], type=int, help="zooms whose rendering changed")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+                        help="limit changed zooms to a bounding box")
+    parser.add_argument("--zoom", nargs=2, type=int, default=(0, MAX_ZOOM), metavar=("MIN", "MAX"),
+                        help="zooms to consider")
+    parser.add_argument("--overviews", type=int, metavar="ZOOM",
+                        help="zooms up to and including ZOOM are derived from their children (as for seed)")
+    parser.add_argument("--format", choices=("ranges", "batches", "keys", "messages"), default="ranges")
+    parser.add_argument("--bucket", default=S3_BUCKET,
+                        help="with --format messages, the bucket of hillshades and of styles without their own "
+                             "(default: S3_BUCKET)")
+    parser.add_argument("--styles", nargs="*", default=list(STYLES), choices=list(STYLES),
+                        help="with --format keys or messages, styles to list")
+    parser.add_argument("--tile-formats", nargs="*", default=["png"], choices=FORMATS,
+                        help="with --format keys or messages, tile formats to list")
+    parser.add_argument("--no-hillshades", dest="hillshades", action="store_false",
+                        help="with --format keys or messages, leave out hillshades")
+
+    args = parser.parse_args(argv)
+
+    templates = style_keys(args.styles, args.tile_formats, args.bucket)
+
+    buckets = set(bucket for bucket, _ in templates) | set([args.bucket] if args.hillshades else [])
+
+    if args.format == "messages" and None in buckets:
+        parser.error("--bucket (or S3_BUCKET) is required for hillshades and styles without their own bucket")
+
+    ranges = plan(args.source_tiles, args.zooms, bbox=args.bbox, min_zoom=args.zoom[0], max_zoom=args.zoom[1],
+                  overviews=args.overviews)
+
+    if args.format == "ranges":
+        lines = (json.dumps(r, sort_keys=True) for r in ranges)
+    elif args.format == "batches":
+        lines = (json.dumps({"batch": r}, sort_keys=True) for r in batches(ranges))
+    elif args.format == "messages":
+        lines = (json.dumps({"Bucket": bucket, "Key": key}, sort_keys=True)
+                 for bucket, key in keys(ranges, templates, args.hillshades, args.bucket))
+    else:
+        lines = (key for _, key in keys(ranges, templates, args.hillshades))
+
+    for line in lines:
+        sys.stdout.write(line + "\n")
+
+    sys.stderr.write("{} tiles in {} ranges\n".format(sum(size(r) for r in ranges), len(ranges)))
+
+    if args.source_tiles:
+        sys.stderr.write("Delete the empty tile index (EMPTY_TILE_INDEX) on each host before re-rendering\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# coding=utf-8
+"""
+Speculative prefetching: after a tile is requested, its neighbours and
+children are likely to be requested next, so they're fetched (rendered, if
+need be) in the background and are already in memory when they are.
+
+Prefetching is strictly lower priority than live requests: workers don't
+start while *busy()* (i.e. live renders are in progress), start at most
+*rate* fetches a second, and only keep the *max_pending* most recently
+scheduled tiles (the older ones, from views the client has probably moved
+on from, are dropped).
+"""
+
+from collections import deque, OrderedDict
+import threading
+import time
+
+from openterrain.cache import ExpiringSet
+
+
+_local = threading.local()
+
+
+def active():
+    """
+    Whether the calling thread is prefetching (so that its fetches aren't
+    treated as requests to prefetch around).
+    """
+    return getattr(_local, "active", False)
+
+
+def neighbours(tile, max_zoom):
+    """
+    Return the 8 tiles around *tile* (wrapping around the antimeridian)
+    and its 4 children (up to max_zoom).
+    """
+    n = 2**tile.z
+    tiles = [tile._replace(x=(tile.x + dx) % n, y=tile.y + dy)
+             for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+             if (dx or dy) and 0 <= tile.y + dy < n]
+
+    if tile.z < max_zoom:
+        tiles += [tile._replace(x=2 * tile.x + dx, y=2 * tile.y + dy, z=tile.z + 1)
+                  for dy in (0, 1) for dx in (0, 1)]
+
+    return [t for t in OrderedDict.fromkeys(tiles) if t != tile]
+
+
+class Prefetcher(object):
+    """
+    Calls fetch(tile) for scheduled tiles on *workers* background threads.
+    Tiles prefetched in the last *ttl* seconds aren't fetched again, and
+    used() counts how many of them were subsequently asked for.
+    """
+
+    def __init__(self, fetch, workers=1, max_pending=32, rate=2.0, busy=lambda: False, ttl=300):
+        self.fetch = fetch
+        self.workers = workers
+        self.rate = rate
+        self.busy = busy
+        self.scheduled = 0
+        self.dropped = 0
+        self.prefetched = 0
+        self.failed = 0
+        self.hits = 0
+        # workers currently fetching
+        self.fetching = 0
+        self._pending = deque(maxlen=max_pending)
+        self._recent = ExpiringSet(ttl)
+        self._condition = threading.Condition()
+        self._next_start = 0
+        self._threads = []
+
+    def stats(self):
+        return dict(scheduled=self.scheduled, dropped=self.dropped, prefetched=self.prefetched,
+                    failed=self.failed, used=self.hits, pending=len(self._pending))
+
+    def schedule(self, tiles):
+        """
+        Queue *tiles* to be fetched, most recently scheduled first, unless
+        they're already queued or were prefetched recently.
+        """
+        with self._condition:
+            self._start()
+
+            for tile in tiles:
+                if tile in self._recent or tile in self._pending:
+                    continue
+
+                if len(self._pending) == self._pending.maxlen:
+                    self.dropped += 1
+
+                self._pending.append(tile)
+                self.scheduled += 1
+
+            self._condition.notify_all()
+
+    def used(self, tile):
+        """
+        Record that *tile* was asked for, returning True if it had been
+        prefetched.
+        """
+        with self._condition:
+            if tile in self._recent:
+                self._recent.discard(tile)
+                self.hits += 1
+                return True
+
+        return False
+
+    def _start(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name="prefetch")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _take(self):
+        """
+        Wait for a tile to prefetch and for its turn (as allowed by busy()
+        and *rate*), returning it.
+        """
+        with self._condition:
+            while True:
+                while not self._pending:
+                    self._condition.wait()
+
+                now = time.time()
+
+                if now >= self._next_start and not self.busy():
+                    self._next_start = max(now, self._next_start) + 1.0 / self.rate
+                    self.fetching += 1
+                    return self._pending.pop()
+
+                self._condition.wait(max(self._next_start - now, 0.05))
+
+    def _run(self):
+        _local.active = True
+
+        while True:
+            tile = self._take()
+
+            try:
+                self.fetch(tile)
+            except Exception:
+                failed = True
+            else:
+                failed = False
+                self._recent.add(tile)
+
+            with self._condition:
+                self.fetching -= 1
+
+                if failed:
+                    self.failed += 1
+                else:
+                    self.prefetched += 1
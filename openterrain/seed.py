@@ -0,0 +1,232 @@
+# coding=utf-8
+"""
+Seed the 3857/{z}/{x}/{y}.tif hillshade pyramid for a bounding box.
+
+    python -m openterrain.seed --bbox -123.0 37.0 -121.5 38.5 --zoom 8 14
+    python -m openterrain.seed --bbox ... --zoom 0 14 --overviews 11 --output /tmp/hillshades
+
+Tiles are rendered in metatiles spread across a process pool. Tiles that
+already exist are skipped, so an interrupted run can be restarted with the
+same arguments.
+
+With --overviews Z, zooms up to and including Z are derived from their
+(already rendered) children by averaging 2x2 pixel blocks instead of being
+rendered from the elevation source. This is much cheaper at low zooms, but
+the result uses the children's vertical exaggeration rather than the
+zoom's own.
+"""
+
+import argparse
+from multiprocessing import Pool
+import os
+import sys
+import time
+
+import mercantile
+import numpy as np
+import rasterio
+
+from openterrain import (decode_hillshade, downsample, DST_TILE_HEIGHT, DST_TILE_WIDTH, encode_hillshade, get_s3,
+                         get_source, get_store, get_upload_pool, hillshade_key, hillshade_meta, MAX_ZOOM,
+                         metatile_bounds, METATILE_SIZE, render_metatile, save_hillshade, Tile)
+
+
+def exists(tile, output=None):
+    if output is not None:
+        return os.path.exists(os.path.join(output, hillshade_key(tile)))
+
+    return get_store().exists(hillshade_key(tile))
+
+
+def read(tile, output=None):
+    """
+    Read an existing hillshade, returning None if it hasn't been rendered.
+    """
+    if output is None:
+        body = get_store().get(hillshade_key(tile))
+
+        return decode_hillshade(body) if body is not None else None
+
+    if not exists(tile, output):
+        return None
+
+    with rasterio.open(os.path.join(output, hillshade_key(tile))) as src:
+        return src.read(1)
+
+
+def write(tile, data, meta, output=None):
+    if output is None:
+        return save_hillshade(tile, data=data, meta=meta)
+
+    path = os.path.join(output, hillshade_key(tile))
+
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        if not os.path.isdir(os.path.dirname(path)):
+            raise
+
+    # write atomically so that interrupted runs don't leave partial tiles behind
+    with open(path + ".tmp", "wb") as f:
+        f.write(encode_hillshade(data, meta))
+
+    os.rename(path + ".tmp", path)
+
+    return path
+
+
+def mosaic(children):
+    """
+    Mosaic a tile's four children ((top left, top right), (bottom left,
+    bottom right)) into a single 2x size array.
+    """
+    data = np.empty((2 * DST_TILE_HEIGHT, 2 * DST_TILE_WIDTH), dtype=np.uint8)
+
+    for j, row in enumerate(children):
+        for i, child in enumerate(row):
+            data[j * DST_TILE_HEIGHT:(j + 1) * DST_TILE_HEIGHT, i * DST_TILE_WIDTH:(i + 1) * DST_TILE_WIDTH] = child
+
+    return data
+
+
+def render(metatile, tiles, output=None, overwrite=False):
+    """
+    Render the tiles in *tiles* that belong to the metatile containing
+    *metatile*. Returns (rendered, skipped, error).
+    """
+    try:
+        todo = [t for t in tiles if overwrite or not exists(t, output)]
+
+        if not todo:
+            return 0, len(tiles), None
+
+        rendered = 0
+        for t, data, meta in render_metatile(metatile, size=METATILE_SIZE):
+            if t in todo:
+                write(t, data, meta, output)
+                rendered += 1
+
+        return rendered, len(tiles) - rendered, None
+    except Exception as e:
+        return 0, 0, "{}: {}".format(metatile, e)
+
+
+def derive(tile, output=None, overwrite=False):
+    """
+    Derive a tile from its children, rendering any that are missing.
+    Returns (rendered, skipped, error).
+    """
+    try:
+        if not overwrite and exists(tile, output):
+            return 0, 1, None
+
+        children = []
+        for y in (2 * tile.y, 2 * tile.y + 1):
+            row = []
+            for x in (2 * tile.x, 2 * tile.x + 1):
+                child = Tile(x, y, tile.z + 1)
+                data = read(child, output)
+
+                if data is None:
+                    [(_, data, meta)] = render_metatile(child, size=1)
+                    write(child, data, meta, output)
+
+                row.append(data)
+            children.append(row)
+
+        write(tile, downsample(mosaic(children)), hillshade_meta(tile), output)
+
+        return 1, 0, None
+    except Exception as e:
+        return 0, 0, "{}: {}".format(tile, e)
+
+
+def init_worker():
+    # GDAL datasets, S3 connections and threads shouldn't be shared across fork()
+    get_source.reset()
+    get_s3.reset()
+    get_upload_pool.reset()
+    get_store.reset()
+
+
+def seed(bbox, min_zoom, max_zoom, overviews=None, processes=None, output=None, overwrite=False):
+    pool = Pool(processes, initializer=init_worker)
+    total = 0
+    started = time.time()
+
+    try:
+        # render from the top of the pyramid down, unless lower zooms are derived from higher ones
+        zooms = range(min_zoom, max_zoom + 1)
+        if overviews is not None:
+            zooms = reversed(zooms)
+
+        for zoom in zooms:
+            tiles = [Tile(t.x, t.y, t.z) for t in mercantile.tiles(*bbox, zooms=[zoom])]
+            zoom_started = time.time()
+
+            if overviews is not None and zoom <= overviews and zoom < MAX_ZOOM:
+                results = pool.imap_unordered(_derive, [(t, output, overwrite) for t in tiles])
+            else:
+                # group tiles by metatile so that each one is rendered from a single source read
+                metatiles = {}
+                for t in tiles:
+                    metatiles.setdefault(metatile_bounds(t, METATILE_SIZE)[:2], []).append(t)
+
+                results = pool.imap_unordered(
+                    _render,
+                    [(Tile(x, y, zoom), ts, output, overwrite) for (x, y), ts in metatiles.items()])
+
+            rendered = skipped = errors = 0
+            for r, s, error in results:
+                rendered += r
+                skipped += s
+
+                if error is not None:
+                    errors += 1
+                    sys.stderr.write("Failed to render {}\n".format(error))
+
+            elapsed = time.time() - zoom_started
+            total += rendered
+            print("z{}: {} rendered, {} skipped, {} failed in {:.1f}s ({:.1f} tiles/s)".format(
+                zoom, rendered, skipped, errors, elapsed, rendered / max(elapsed, 1e-6)))
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - started
+    print("{} tiles rendered in {:.1f}s ({:.1f} tiles/s)".format(total, elapsed, total / max(elapsed, 1e-6)))
+
+
+def _derive(args):
+    return derive(*args)
+
+
+def _render(args):
+    return render(*args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed hillshades for a bounding box")
+    parser.add_argument("--bbox", nargs=4, type=float, required=True, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    parser.add_argument("--zoom", nargs=2, type=int, required=True, metavar=("MIN", "MAX"))
+    parser.add_argument("--overviews", type=int, metavar="ZOOM",
+                        help="derive zooms up to and including ZOOM from their children")
+    parser.add_argument("--processes", type=int, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--output", help="write to a local directory instead of the tile store (TILE_STORE)")
+    parser.add_argument("--overwrite", action="store_true", help="re-render tiles that already exist")
+
+    args = parser.parse_args(argv)
+    min_zoom, max_zoom = args.zoom
+
+    if not 0 <= min_zoom <= max_zoom <= MAX_ZOOM:
+        parser.error("Invalid zoom range")
+
+    seed(args.bbox, min_zoom, max_zoom,
+         overviews=args.overviews,
+         processes=args.processes,
+         output=args.output,
+         overwrite=args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# coding=utf-8
+
+import numpy as np
+
+from openterrain import timing
+from openterrain.timing import span
+
+
+# maximum difference (in uint8 levels) between shade() and the float64
+# hillshade() * slopeshade() reference; float32 rounding can push a pixel
+# across an integer boundary before truncation
+TOLERANCE = 1
+
+# fewest rows shaded as a strip of their own (fewer aren't worth a thread)
+MIN_STRIP_ROWS = 128
+
+
+def gradient(elevation, dx, dy, vert_exag=1, out=None, rows=None):
+    """
+    Equivalent to np.gradient(vert_exag * elevation, dy, dx), computed in
+    float32 and written into *out* (a pair of arrays shaped like
+    *elevation*) without materializing the exaggerated surface. With *rows*
+    (start, stop), only those rows of the gradient are computed (from
+    those rows of *elevation* and the ones either side).
+    """
+    if out is None:
+        out = (np.empty(elevation.shape, dtype=np.float32),
+               np.empty(elevation.shape, dtype=np.float32))
+
+    gy, gx = out
+    height = elevation.shape[0]
+    start, stop = rows or (0, height)
+
+    # rows (central differences, except at the edges)
+    lo = max(start, 1)
+    hi = min(stop, height - 1)
+    np.subtract(elevation[lo + 1:hi + 1], elevation[lo - 1:hi - 1], out=gy[lo:hi])
+    gy[lo:hi] *= vert_exag / (2.0 * dy)
+
+    if start == 0:
+        np.subtract(elevation[1], elevation[0], out=gy[0])
+        gy[0] *= vert_exag / float(dy)
+
+    if stop == height:
+        np.subtract(elevation[-1], elevation[-2], out=gy[-1])
+        gy[-1] *= vert_exag / float(dy)
+
+    # columns
+    elevation = elevation[start:stop]
+    gx = gx[start:stop]
+    np.subtract(elevation[:, 2:], elevation[:, :-2], out=gx[:, 1:-1])
+    gx[:, 1:-1] *= vert_exag / (2.0 * dx)
+    np.subtract(elevation[:, 1], elevation[:, 0], out=gx[:, 0])
+    np.subtract(elevation[:, -1], elevation[:, -2], out=gx[:, -1])
+    gx[:, 0] *= vert_exag / float(dx)
+    gx[:, -1] *= vert_exag / float(dx)
+
+    return out
+
+
+def strips(height, count, min_rows=MIN_STRIP_ROWS):
+    """
+    Split *height* rows into up to *count* (start, stop) strips of at least
+    *min_rows* rows (bar a shorter window's single strip).
+    """
+    count = max(min(count, height // min_rows), 1)
+    bounds = [height * i // count for i in range(count + 1)]
+
+    return list(zip(bounds, bounds[1:]))
+
+
+def shade(elevation, azdeg=315, altdeg=45, vert_exag=1, dx=1, dy=1, fraction=1.,
+          add_slopeshade=True, out=None, scratch=None, workers=1, pool=None):
+    """
+    Fused equivalent of
+
+        255 * hillshade(elevation, ...) * slopeshade(elevation, ...)
+
+    truncated to uint8. The gradient is computed once and both terms are
+    derived from it in float32, in place.
+
+    Expanding the trigonometry in hillshade() gives, for gradients gx, gy
+    and light source azimuth az / altitude alt:
+
+        intensity = (sin(alt) - cos(alt) * (gx * cos(az) + gy * sin(az)))
+                    / sqrt(1 + gx² + gy²)
+
+    so the only transcendental left per pixel is slopeshade()'s arctan.
+
+    Every step after the gradient is per pixel, and each row's gradient
+    only needs the rows either side of it, so the window can be shaded in
+    row strips concurrently (NumPy releases the GIL) with exactly the same
+    result.
+
+    Parameters
+    ----------
+    elevation : array-like
+        A 2d array of height values.
+    azdeg, altdeg, vert_exag, dx, dy, fraction : number, optional
+        As for hillshade().
+    add_slopeshade : bool, optional
+        Multiply by slopeshade() (the default, matching render_hillshade).
+    out : ndarray, optional
+        A uint8 array shaped like *elevation* to write the result into.
+    scratch : tuple of ndarray, optional
+        Three float32 arrays shaped like *elevation* to work in (allocated
+        if not provided).
+    workers : int, optional
+        Number of row strips (of at least MIN_STRIP_ROWS) to shade the
+        window in.
+    pool : ThreadPool, optional
+        Where to shade the strips (on the calling thread, one after the
+        other, if not provided).
+
+    Returns
+    -------
+    shaded : ndarray
+        A 2d uint8 array that differs from the float64 reference by at most
+        TOLERANCE.
+    """
+    if out is None:
+        out = np.empty(elevation.shape, dtype=np.uint8)
+
+    az = np.radians(90 - azdeg)
+    alt = np.radians(altdeg)
+
+    if scratch is None:
+        scratch = tuple(np.empty(elevation.shape, dtype=np.float32) for _ in range(3))
+
+    def shade_rows(rows):
+        start, stop = rows
+        gradient(elevation, dx, dy, vert_exag=vert_exag, out=scratch[:2], rows=rows)
+        gy, gx, tmp = [a[start:stop] for a in scratch]
+
+        # |gradient| into tmp
+        np.hypot(gx, gy, out=tmp)
+
+        # light term into gx; gy is free after this
+        gx *= float(-np.cos(alt) * np.cos(az))
+        gy *= float(-np.cos(alt) * np.sin(az))
+        gx += gy
+        gx += float(np.sin(alt))
+
+        # intensity = light term / sqrt(1 + |gradient|²)
+        np.multiply(tmp, tmp, out=gy)
+        gy += 1
+        np.sqrt(gy, out=gy)
+        gx /= gy
+        gx *= fraction
+        np.clip(gx, 0, 1, out=gx)
+
+        if add_slopeshade:
+            # slopeshade = 1 - (2 / pi) * arctan(|gradient|)
+            np.arctan(tmp, out=tmp)
+            tmp *= -2 / np.pi
+            tmp += 1
+            gx *= tmp
+
+        with span("uint8"):
+            gx *= 255.0
+
+            # float -> uint8 truncates, as .astype(np.uint8) does
+            np.copyto(out[start:stop], gx, casting="unsafe")
+
+    rows = strips(elevation.shape[0], workers)
+
+    if pool is None or len(rows) == 1:
+        for r in rows:
+            shade_rows(r)
+    else:
+        request = timing.current()
+
+        def shade_strip(rows):
+            with timing.attach(request):
+                shade_rows(rows)
+
+        pool.map(shade_strip, rows)
+
+    return out
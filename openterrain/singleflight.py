@@ -0,0 +1,180 @@
+# coding=utf-8
+"""
+Coalescing concurrent renders of the same thing, so that a burst of
+requests for a tile that hasn't been rendered yet renders (and stores) it
+once.
+
+Within a process, SingleFlight runs one call per key at a time and hands
+its result to everyone who asked for the same key in the meantime. Across
+processes on the same host, Leases are exclusive flock()s on per-key lock
+files: whoever waited for a lease should check whether its holder produced
+what they need before rendering it themselves. Locks held by a process that
+crashes are released by the kernel; a holder that hangs is taken over once
+*timeout* seconds have been spent waiting for it.
+"""
+
+import errno
+import fcntl
+import os
+import threading
+import time
+
+
+class SingleFlight(object):
+    """
+    Calls made through do() with the same key while one is in flight wait
+    for it and share its result (or exception).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return dict(calls=self.calls, shared=self.shared, in_flight=len(self._flights))
+
+    def do(self, key, fn):
+        """
+        Return (fn(), shared), shared being True if another thread's call
+        for *key* provided the result.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+
+            if flight.error is not None:
+                raise flight.error
+
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+            flight.done.set()
+
+        return flight.result, False
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Leases(object):
+    """
+    Exclusive leases shared by the processes using lock files under *path*
+    (which should be local to the host).
+    """
+
+    def __init__(self, path, timeout, poll_interval=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.waits = 0
+        self.timeouts = 0
+
+    def stats(self):
+        return dict(waits=self.waits, timeouts=self.timeouts)
+
+    def acquire(self, name):
+        """
+        Acquire the lease on *name* (a relative path), waiting for up to
+        *timeout* seconds for another process to release it. Returns a
+        Lease, which isn't held if the wait timed out.
+        """
+        path = os.path.join(self.path, "{}.lock".format(name))
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        f = open(path, "a+")
+        deadline = time.time() + self.timeout
+        waited = False
+
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    f.close()
+                    raise
+
+            if not waited:
+                waited = True
+                self.waits += 1
+
+            if time.time() >= deadline:
+                self.timeouts += 1
+                f.close()
+                return Lease(None, waited=True)
+
+            time.sleep(self.poll_interval)
+
+        return Lease(f, waited=waited)
+
+
+class Lease(object):
+    """
+    A lease acquired from Leases. *released_at* is when a previous holder
+    last released it with completed=True (or None).
+    """
+
+    def __init__(self, f=None, waited=False):
+        self.held = f is not None
+        self.waited = waited
+        self.released_at = None
+        self._file = f
+
+        if f is not None:
+            f.seek(0)
+            content = f.read().strip()
+
+            try:
+                self.released_at = float(content) if content else None
+            except ValueError:
+                # written by a holder that was killed mid-release
+                pass
+
+    def release(self, completed=True):
+        """
+        Release the lease (if held), recording the time if the holder
+        completed what it was leased for. Safe to call more than once, and
+        from any thread.
+        """
+        f, self._file = self._file, None
+
+        if f is None:
+            return
+
+        try:
+            if completed:
+                f.seek(0)
+                f.truncate()
+                f.write(repr(time.time()))
+                f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
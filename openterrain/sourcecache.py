@@ -0,0 +1,189 @@
+# coding=utf-8
+"""
+A persistent on-disk cache of elevation source tiles, shared between
+processes.
+
+Tiles are stored as {path}/{z}/{x}/{y}.tif, exactly as fetched. Missing
+source tiles (403/404, which GDAL_WMS treats as zero-filled blocks) are
+cached as empty files. Files are written to a temporary name and renamed
+into place, so concurrent readers never see partial tiles; each hit bumps
+the file's mtime and the least recently used tiles are evicted once the
+cache grows past its size limit.
+"""
+
+import errno
+import fcntl
+import os
+import threading
+import urllib2
+
+import rasterio
+from rasterio.errors import RasterioIOError
+
+from openterrain.sources import read_tiles
+
+
+SOURCE_URL = "https://s3.amazonaws.com/elevation-tiles-prod/geotiff/{z}/{x}/{y}.tif"
+
+# fraction of the size limit written (by this process) between eviction sweeps
+SWEEP_INTERVAL = 0.1
+# sweeps evict down to this fraction of the size limit
+LOW_WATER_MARK = 0.9
+
+
+class SourceTileCache(object):
+    def __init__(self, path, max_size, url=SOURCE_URL):
+        self.path = path
+        self.max_size = max_size
+        self.url = url
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._written = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def tile_path(self, z, x, y):
+        return os.path.join(self.path, str(z), str(x), "{}.tif".format(y))
+
+    def get(self, z, x, y):
+        """
+        Return a source tile as a 2d int16 array, fetching and caching it
+        if necessary. Missing tiles are returned as None.
+        """
+        path = self.tile_path(z, x, y)
+
+        try:
+            os.utime(path, None)
+            data = self._read(path)
+        except (EnvironmentError, RasterioIOError):
+            # not cached (or evicted by another process in the meantime)
+            pass
+        else:
+            self.hits += 1
+            return data
+
+        self.misses += 1
+
+        return self.put(z, x, y, self.fetch(z, x, y))
+
+    def fetch(self, z, x, y):
+        try:
+            return urllib2.urlopen(self.url.format(z=z, x=x, y=y)).read()
+        except urllib2.HTTPError as e:
+            if e.code in (403, 404):
+                return b""
+            raise
+
+    def put(self, z, x, y, data):
+        """
+        Cache a source tile as fetched, returning it decoded (as get() does).
+        """
+        path = self.tile_path(z, x, y)
+        # one per thread, as threads may miss on the same tile at once
+        tmp_path = "{}.{}-{}.tmp".format(path, os.getpid(), threading.current_thread().ident)
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        # decoded before it's renamed into place, where it may be evicted at any time
+        try:
+            tile = self._read(tmp_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        os.rename(tmp_path, path)
+
+        self._written += len(data)
+        if self._written >= self.max_size * SWEEP_INTERVAL:
+            self.sweep()
+
+        return tile
+
+    def sweep(self):
+        """
+        Evict least recently used tiles until the cache is below its low
+        water mark. Only one process sweeps at a time; others skip it.
+        """
+        with open(os.path.join(self.path, ".lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return
+                raise
+
+            try:
+                self._written = 0
+                entries = []
+                total = 0
+
+                for root, _, filenames in os.walk(self.path):
+                    for filename in filenames:
+                        if not filename.endswith(".tif"):
+                            continue
+
+                        path = os.path.join(root, filename)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+
+                        entries.append((st.st_mtime, st.st_size, path))
+                        total += st.st_size
+
+                if total <= self.max_size:
+                    return
+
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_size * LOW_WATER_MARK:
+                        break
+
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        continue
+
+                    total -= size
+                    self.evictions += 1
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self, path):
+        if os.path.getsize(path) == 0:
+            return None
+
+        with rasterio.open(path) as src:
+            return src.read(1)
+
+
+class CachedSource(object):
+    """
+    Wraps the GDAL_WMS source dataset so that reads are assembled from
+    source tiles in a SourceTileCache. Everything other than read() is
+    delegated to the dataset.
+    """
+
+    def __init__(self, dataset, cache, max_zoom=14):
+        self.dataset = dataset
+        self.cache = cache
+        self.max_zoom = max_zoom
+
+    def __getattr__(self, name):
+        return getattr(self.dataset, name)
+
+    def read(self, band, out, window):
+        """
+        Read *window* (in pixels at max_zoom) into *out*, as read_tiles()
+        does.
+        """
+        return read_tiles(self.cache, out, window, self.max_zoom)
@@ -0,0 +1,284 @@
+# coding=utf-8
+"""
+Elevation sources: what render_metatile() and hillshade_meta() read from.
+A source covers the mapzen.xml grid (EPSG:3857, 512px tiles at
+MAX_ZOOM) and supports decimated windowed reads (read(band, out, window),
+with windows in pixels at MAX_ZOOM), affine, crs, meta, profile and
+window_transform(). Sources are opened from ELEVATION_SOURCE (see
+open_source()):
+
+    mapzen.xml       a GDAL dataset (here, GDAL_WMS over HTTP)
+    mmap:///path     a local store of raw tiles (see MappedTileStore)
+
+A MappedTileStore for a region can be staged from the elevation tiles that
+mapzen.xml reads:
+
+    python -m openterrain.sources --bbox -123.0 37.0 -121.5 38.5 --zoom 8 14 /data/elevation
+"""
+
+import argparse
+import errno
+import math
+import os
+import shutil
+import tempfile
+import threading
+
+from affine import Affine
+import mercantile
+import numpy as np
+import rasterio
+
+
+MAX_ZOOM = 14
+TILE_SIZE = 512
+
+# from mapzen.xml
+EXTENT = 20037508.34
+NODATA = -32768
+
+
+class WorldSource(object):
+    """
+    The geometry of mapzen.xml; subclasses implement read().
+    """
+
+    crs = {"init": "epsg:3857"}
+    width = 2**MAX_ZOOM * TILE_SIZE
+    height = 2**MAX_ZOOM * TILE_SIZE
+    affine = Affine(2 * EXTENT / width, 0, -EXTENT,
+                    0, -2 * EXTENT / height, EXTENT)
+    profile = {"dtype": "int16"}
+
+    @property
+    def meta(self):
+        return {
+            "driver": "WMS",
+            "dtype": "int16",
+            "nodata": NODATA,
+            "width": self.width,
+            "height": self.height,
+            "count": 1,
+            "crs": self.crs,
+            "transform": self.affine,
+            "affine": self.affine,
+        }
+
+    def window_transform(self, window):
+        (row_start, _), (col_start, _) = window
+
+        return self.affine * Affine.translation(col_start, row_start)
+
+    def read(self, band, out, window):
+        raise NotImplementedError
+
+
+class ThreadLocalDataset(object):
+    """
+    A rasterio dataset opened separately by each thread that uses it, since
+    GDAL datasets can't be shared between threads. Everything is delegated
+    to the calling thread's dataset.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        dataset = getattr(self._local, "dataset", None)
+
+        if dataset is None:
+            dataset = self._local.dataset = rasterio.open(self.path)
+
+        return getattr(dataset, name)
+
+
+def read_tiles(tiles, out, window, max_zoom=MAX_ZOOM):
+    """
+    Read *window* (in pixels at max_zoom) from *tiles* (anything with
+    get(z, x, y), returning a TILE_SIZE x TILE_SIZE array or None for
+    missing tiles, which are read as 0) into *out*, from the zoom whose
+    resolution matches out's, as GDAL does when choosing overviews for a
+    decimated read. Windows smaller than out (beyond max_zoom) are upsampled
+    by pixel replication.
+
+    A window that falls within a single tile is returned as a view of that
+    tile rather than copied into *out*.
+    """
+    (row_start, row_stop), (col_start, col_stop) = window
+    dz = int(round(math.log((row_stop - row_start) / float(out.shape[0]), 2)))
+    zoom = max_zoom - max(dz, 0)
+    factor = 2**max(-dz, 0)
+
+    # window at zoom
+    row_start, row_stop, col_start, col_stop = [int(v / 2**max(dz, 0))
+                                                for v in (row_start, row_stop, col_start, col_stop)]
+
+    ys = range(row_start // TILE_SIZE, (row_stop - 1) // TILE_SIZE + 1)
+    xs = range(col_start // TILE_SIZE, (col_stop - 1) // TILE_SIZE + 1)
+
+    if len(ys) == 1 and len(xs) == 1 and factor == 1:
+        tile = tiles.get(zoom, xs[0], ys[0])
+
+        if tile is None:
+            out.fill(0)
+            return out
+
+        if tile.dtype == out.dtype:
+            return tile[row_start - ys[0] * TILE_SIZE:row_stop - ys[0] * TILE_SIZE,
+                        col_start - xs[0] * TILE_SIZE:col_stop - xs[0] * TILE_SIZE]
+
+    # assemble straight into out unless it needs upsampling
+    if factor == 1:
+        data = out
+    else:
+        data = np.empty((row_stop - row_start, col_stop - col_start), dtype=out.dtype)
+
+    for y in ys:
+        for x in xs:
+            tile = tiles.get(zoom, x, y)
+
+            # intersection of the window and the tile, in pixels at zoom
+            r0 = max(row_start, y * TILE_SIZE)
+            r1 = min(row_stop, (y + 1) * TILE_SIZE)
+            c0 = max(col_start, x * TILE_SIZE)
+            c1 = min(col_stop, (x + 1) * TILE_SIZE)
+
+            target = data[r0 - row_start:r1 - row_start, c0 - col_start:c1 - col_start]
+
+            if tile is None:
+                target.fill(0)
+            else:
+                target[:] = tile[r0 - y * TILE_SIZE:r1 - y * TILE_SIZE, c0 - x * TILE_SIZE:c1 - x * TILE_SIZE]
+
+    if factor > 1:
+        out[:] = data.repeat(factor, axis=0).repeat(factor, axis=1)
+
+    return out
+
+
+class TiledSource(WorldSource):
+    """
+    A source read from the tiles in *tiles* (see read_tiles()).
+    """
+
+    def __init__(self, tiles, max_zoom=MAX_ZOOM):
+        self.tiles = tiles
+        self.max_zoom = max_zoom
+
+    def read(self, band, out, window):
+        return read_tiles(self.tiles, out, window, self.max_zoom)
+
+
+class MappedTileStore(object):
+    """
+    Elevation tiles stored under *path* as {z}/{x}/{y}.raw: TILE_SIZE x
+    TILE_SIZE little-endian int16s, in rows, with no header. They're
+    memory-mapped when read, so hot tiles stay in the page cache, shared
+    between processes. Missing source tiles are stored as empty files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def tile_path(self, z, x, y):
+        return os.path.join(self.path, str(z), str(x), "{}.raw".format(y))
+
+    def get(self, z, x, y):
+        path = self.tile_path(z, x, y)
+
+        try:
+            if os.path.getsize(path) == 0:
+                return None
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+
+            raise
+
+        return np.memmap(path, dtype="<i2", mode="r", shape=(TILE_SIZE, TILE_SIZE))
+
+    def put(self, z, x, y, data):
+        path = self.tile_path(z, x, y)
+        # one per thread, as threads may store the same tile at once
+        tmp_path = "{}.{}-{}.tmp".format(path, os.getpid(), threading.current_thread().ident)
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        with open(tmp_path, "wb") as f:
+            if data is not None:
+                f.write(np.ascontiguousarray(data, dtype="<i2").tobytes())
+
+        os.rename(tmp_path, path)
+
+
+def open_source(url):
+    """
+    Open the elevation source at *url*: mmap:///path for a MappedTileStore,
+    anything else is opened (per thread) with rasterio.
+    """
+    if url.startswith("mmap://"):
+        return TiledSource(MappedTileStore(url[len("mmap://"):]))
+
+    return ThreadLocalDataset(url)
+
+
+def stage(store, bbox, min_zoom, max_zoom, buffer=1):
+    """
+    Copy the source tiles covering *bbox* (plus *buffer* tiles around it, so
+    that the edges' buffered reads are complete) at each zoom into *store*,
+    skipping those already there. Returns the number copied.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    from openterrain.sourcecache import SourceTileCache
+
+    tiles = []
+
+    for zoom in range(min_zoom, max_zoom + 1):
+        ul = mercantile.tile(bbox[0], bbox[3], zoom)
+        lr = mercantile.tile(bbox[2], bbox[1], zoom)
+
+        for y in range(max(ul.y - buffer, 0), min(lr.y + buffer, 2**zoom - 1) + 1):
+            for x in range(max(ul.x - buffer, 0), min(lr.x + buffer, 2**zoom - 1) + 1):
+                if not os.path.exists(store.tile_path(zoom, x, y)):
+                    tiles.append((zoom, x, y))
+
+    def copy(tile):
+        store.put(*(tile + (cache.get(*tile),)))
+        os.unlink(cache.tile_path(*tile))
+
+    # SourceTileCache fetches and decodes tiles; it's only needed for the duration
+    path = tempfile.mkdtemp()
+    cache = SourceTileCache(path, max_size=float("inf"))
+    pool = ThreadPool(8)
+
+    try:
+        pool.map(copy, tiles)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(path, ignore_errors=True)
+
+    return len(tiles)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage elevation tiles for a region in a local MappedTileStore")
+    parser.add_argument("--bbox", type=float, nargs=4, required=True, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    parser.add_argument("--zoom", type=int, nargs=2, required=True, metavar=("MIN", "MAX"))
+    parser.add_argument("path")
+
+    args = parser.parse_args(argv)
+
+    copied = stage(MappedTileStore(args.path), args.bbox, args.zoom[0], min(args.zoom[1], MAX_ZOOM))
+    print("{} tiles staged in {}; use ELEVATION_SOURCE=mmap://{}".format(copied, args.path,
+                                                                         os.path.abspath(args.path)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+Lazy initialization of module state, plus the bookkeeping needed to see
+what a cold start spends its time on (see benchmarks/coldstart.py).
+"""
+
+from collections import OrderedDict
+import functools
+import sys
+import threading
+import time
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+
+# lazily initialized values, in definition order
+LAZY = []
+
+# initialization time (in seconds) of each lazy value that's been used
+TIMINGS = OrderedDict()
+
+
+def lazy(fn):
+    """
+    Decorate a function that takes no arguments so that it's called on
+    first use only; later calls return the same value. reset() discards it
+    (e.g. after fork()); set() replaces it (e.g. with a stand-in for
+    benchmarking).
+    """
+    state = {}
+    lock = threading.Lock()
+
+    @functools.wraps(fn)
+    def wrapper():
+        if "value" not in state:
+            with lock:
+                if "value" not in state:
+                    start = time.time()
+                    state["value"] = fn()
+                    TIMINGS["{}.{}".format(fn.__module__, fn.__name__)] = time.time() - start
+
+        return state["value"]
+
+    def set(value):
+        with lock:
+            state["value"] = value
+
+    wrapper.reset = state.clear
+    wrapper.set = set
+    LAZY.append(wrapper)
+
+    return wrapper
+
+
+def install_import_hook(timings):
+    """
+    Time every module imported from now on, accumulating the time spent
+    importing each top-level package (excluding the packages it imports in
+    turn) into *timings*.
+    """
+    original = builtins.__import__
+    stack = []
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=-1 if sys.version_info[0] < 3 else 0):
+        if not name or name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        package = name.split(".")[0]
+        if level != 0 and globals:
+            # relative import; attribute it to the importing package
+            package = (globals.get("__name__") or name).split(".")[0]
+
+        stack.append([package, 0])
+        start = time.time()
+
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            _, children = stack.pop()
+
+            timings[package] = timings.get(package, 0) + elapsed - children
+
+            if stack:
+                stack[-1][1] += elapsed
+
+    builtins.__import__ = timed_import
+
+    return original
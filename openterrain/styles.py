@@ -0,0 +1,288 @@
+# coding=utf-8
+"""
+Styled tiles, colorized from hillshades.
+
+Styles are declared in STYLES, each with a ramp (see compile_ramp()) and
+optionally:
+
+    prefix    key prefix (default: the style's name)
+    bucket    where its tiles go, if not S3_BUCKET
+    metadata  S3 metadata, formatted with the tile's z, x and y
+    headers   other put_object() arguments, overriding the defaults
+
+handle() renders any number of styles from a single hillshade fetch (or
+render) per tile, encoding them concurrently and storing them together, so
+adding a style costs no extra source reads or renders. Tiles are PNGs or,
+where supported, WebPs (see openterrain.colorize.get_formats()).
+"""
+
+from collections import OrderedDict
+import multiprocessing
+import os
+import re
+
+from openterrain import (flush_hillshades, get_hillshade, get_hillshades, get_metatile, MAX_METATILE_SIZE, MAX_ZOOM,
+                         METATILE_SIZE, put_objects, S3_BUCKET, Tile)
+from openterrain import batch
+from openterrain import timing
+from openterrain.colorize import compile_ramp, encode_tiles, get_formats
+from openterrain.startup import lazy
+
+
+POSITRON_RAMP = {
+    "red": [(0.0, 0.0, 0.3),
+            (1.0, 1.0, 1.0)],
+    "green": [(0.0, 0.0, 0.3),
+              (1.0, 1.0, 1.0)],
+    "blue": [(0.0, 0.0, 0.3),
+             (1.0, 1.0, 1.0)],
+    "alpha": [(0.0, 0.7, 0.7),
+              (195 / 255.0, 0.0, 0.0),
+              (1.0, 1.0, 1.0)]
+}
+
+DARKMATTER_RAMP = {
+    "red": [(0.0, 60 / 255.0, 60 / 255.0),
+            (1.0, 220 / 255.0, 220 / 255.0)],
+    "green": [(0.0, 75 / 255.0, 75 / 255.0),
+              (1.0, 1.0, 1.0)],
+    "blue": [(0.0, 80 / 255.0, 80 / 255.0),
+             (1.0, 100 / 255.0, 100 / 255.0)],
+    "alpha": [(0.0, 0.4, 0.4),
+              (180 / 255.0, 0.0, 0.0),
+              (1.0, 0.2, 0.2)]
+}
+
+GREY_HILLS_RAMP = {
+    "red": [(0.0, 0.0, 0.0),
+            (0.25, 0.0, 0.0),
+            (180 / 255.0, 0.5, 0.5),
+            (1.0, 170 / 255.0, 170 / 255.0)],
+    "green": [(0.0, 0.0, 0.0),
+              (0.25, 0.0, 0.0),
+              (180 / 255.0, 0.5, 0.5),
+              (1.0, 170 / 255.0, 170 / 255.0)],
+    "blue": [(0.0, 0.0, 0.0),
+             (0.25, 0.0, 0.0),
+             (180 / 255.0, 0.5, 0.5),
+             (1.0, 170 / 255.0, 170 / 255.0)],
+}
+
+STYLES = OrderedDict([
+    ("positron", dict(ramp=POSITRON_RAMP)),
+    ("darkmatter", dict(ramp=DARKMATTER_RAMP)),
+    ("terrain-grey-hills", dict(
+        ramp=GREY_HILLS_RAMP,
+        bucket="tile.stamen.com",
+        metadata={"Surrogate-Key": "terrain-grey-hills terrain-grey-hills/z{z}"},
+    )),
+])
+
+# tiles encoded at once
+ENCODE_CONCURRENCY = int(os.environ.get("ENCODE_CONCURRENCY", multiprocessing.cpu_count()))
+
+_colormaps = {}
+
+
+@lazy
+def get_encode_pool():
+    from multiprocessing.pool import ThreadPool
+
+    return ThreadPool(ENCODE_CONCURRENCY)
+
+
+@lazy
+def get_sentry():
+    from raven import Client
+
+    return Client()
+
+
+def get_colormap(name):
+    colormap = _colormaps.get(name)
+
+    if colormap is None:
+        colormap = _colormaps[name] = compile_ramp(STYLES[name]["ramp"])
+
+    return colormap
+
+
+def style_key(name, tile, scale, format="png"):
+    return "{}/{}/{}/{}{}.{}".format(STYLES[name].get("prefix", name), tile.z, tile.x, tile.y,
+                                     "@2x" if scale == 2 else "", format)
+
+
+def style_object(name, tile, scale, body, format="png"):
+    """
+    Return the put_object() arguments that store a styled tile.
+    """
+    style = STYLES[name]
+    obj = dict(
+        Bucket=style.get("bucket", S3_BUCKET),
+        Key=style_key(name, tile, scale, format),
+        Body=body,
+        ACL="public-read",
+        ContentType="image/{}".format(format),
+        CacheControl="public, max-age=2592000",
+        StorageClass="REDUCED_REDUNDANCY",
+    )
+
+    if "metadata" in style:
+        obj["Metadata"] = dict((k, v.format(z=tile.z, x=tile.x, y=tile.y)) for k, v in style["metadata"].items())
+
+    obj.update(style.get("headers", {}))
+
+    return obj
+
+
+def save_styles(hillshades, styles, scale, format="png"):
+    """
+    Colorize each of a list of (tile, hillshade) in each of *styles*
+    (names), at *scale* and @2x, and store them all together. Returns
+    {style: {tile: location}}, with the locations of the tiles at *scale*.
+    """
+    # the 1x version is box-filtered from the same hillshade
+    scales = (2, 1) if scale == 1 else (2,)
+    jobs = [(name, tile, hs) for tile, hs in hillshades for name in styles]
+    request = timing.current()
+
+    def encode(job):
+        name, tile, hs = job
+
+        with timing.attach(request):
+            return encode_tiles(hs, get_colormap(name), scales, format)
+
+    if len(jobs) > 1:
+        encoded = get_encode_pool().map(encode, jobs)
+    else:
+        encoded = [encode(job) for job in jobs]
+
+    objects = []
+    tiles = []
+
+    for (name, tile, _), bodies in zip(jobs, encoded):
+        for s, body in bodies:
+            objects.append(style_object(name, tile, s, body, format))
+            tiles.append((name, tile))
+
+    locations = OrderedDict((name, {}) for name in styles)
+
+    # the last location of each tile (its requested scale) wins
+    for (name, tile), location in zip(tiles, put_objects(objects)):
+        locations[name][tile] = location
+
+    return locations
+
+
+def by_tile(locations):
+    """
+    Return each tile's location, or {style: location} if there's more than
+    one style, from the result of save_styles().
+    """
+    if len(locations) == 1:
+        return list(locations.values())[0]
+
+    tiles = {}
+
+    for name, styled in locations.items():
+        for tile, location in styled.items():
+            tiles.setdefault(tile, {})[name] = location
+
+    return tiles
+
+
+def handle_batch(event, context, styles, function):
+    tiles = batch.parse_tiles(event["batch"])
+    metatile = int(event["batch"].get("metatile", METATILE_SIZE))
+    scale = int(event["batch"].get("scale", 1))
+    format = event["batch"].get("format", "png")
+
+    if format not in get_formats():
+        raise Exception("Invalid format")
+
+    if not 0 < scale <= 2:
+        raise Exception("Invalid scale")
+
+    if not 0 < metatile <= MAX_METATILE_SIZE:
+        raise Exception("Invalid metatile size")
+
+    def report(exc_info):
+        get_sentry().captureException(exc_info=exc_info)
+
+    with timing.request(function=function, tiles=len(tiles), scale=scale, metatile=metatile):
+        try:
+            # hillshades that aren't cached are rendered a metatile at a time
+            return batch.run(
+                batch.group_tiles(tiles, metatile),
+                lambda group: by_tile(save_styles(get_hillshades(group, size=metatile), styles, scale, format)),
+                context=context,
+                on_error=report,
+            )
+        finally:
+            for exc_info in flush_hillshades():
+                report(exc_info)
+
+
+def handle(event, context, styles=list(STYLES), function="styles"):
+    """
+    Render a tile (or, with "batch", many tiles; see openterrain.batch) in
+    each of *styles* from a single hillshade.
+    """
+    if "batch" in event:
+        return handle_batch(event, context, styles, function)
+
+    zoom = int(event["params"]["path"]["z"])
+    x = int(event["params"]["path"]["x"])
+    filename, format = event["params"]["path"]["y"].split(".")
+
+    parts = filename.split("@")
+    y = int(parts[0])
+    if len(parts) > 1:
+        scale = int(re.sub(r"[^\d]", "", parts[1]))
+    else:
+        scale = 1
+
+    tile = Tile(x, y, zoom)
+    metatile = int(event["params"].get("querystring", {}).get("metatile", 1))
+
+    if format not in get_formats():
+        raise Exception("Invalid format")
+
+    if not 0 <= tile.z <= MAX_ZOOM:
+        raise Exception("Invalid zoom")
+
+    if not 0 < scale <= 2:
+        raise Exception("Invalid scale")
+
+    if not 0 <= tile.x < 2**tile.z:
+        raise Exception("Invalid coordinates")
+
+    if not 0 <= tile.y < 2**tile.z:
+        raise Exception("Invalid coordinates")
+
+    if not 0 < metatile <= MAX_METATILE_SIZE:
+        raise Exception("Invalid metatile size")
+
+    with timing.request(function=function, tile="{}/{}/{}".format(tile.z, tile.x, tile.y), scale=scale,
+                        metatile=metatile):
+        try:
+            if metatile > 1:
+                # render (and cache) every hillshade in the metatile from a single source read
+                hillshades = get_metatile(tile, size=metatile)
+            else:
+                hillshades = [(tile, get_hillshade(tile))]
+
+            locations = save_styles(hillshades, styles, scale, format)
+        except:
+            get_sentry().captureException()
+            raise
+        finally:
+            # hillshades may still be being saved in the background
+            for exc_info in flush_hillshades():
+                get_sentry().captureException(exc_info=exc_info)
+
+    return {
+        "location": locations[styles[0]][tile],
+        "locations": sorted(location for styled in locations.values() for location in styled.values()),
+        "styles": dict((name, styled[tile]) for name, styled in locations.items()),
+    }
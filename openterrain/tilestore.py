@@ -0,0 +1,295 @@
+# coding=utf-8
+"""
+Where rendered tiles (hillshades and the PNGs styled from them) are kept.
+Stores are opened from a URL (see open_store()):
+
+    s3://bucket      one S3 object per tile
+    file:///path     one file per tile, at {path}/{key}
+    bundle:///path   tiles packed into bundle files (see BundleStore)
+
+Each store has get(key), returning a tile's bytes (or None if it hasn't
+been stored), exists(key), url(key) and put(objects), which stores a list
+of put_object()-style dicts (Key and Body; S3 uses the rest as well) and
+returns their URLs.
+"""
+
+from collections import OrderedDict
+import errno
+import fcntl
+import os
+import re
+import struct
+import threading
+
+
+# tiles across (and down) a bundle
+TILE_BUNDLE_SIZE = int(os.environ.get("TILE_BUNDLE_SIZE", 16))
+
+# S3 error codes meaning a key doesn't exist: without s3:ListBucket, S3
+# answers requests for missing keys with 403s (AccessDenied for GETs)
+S3_MISSING = ("NoSuchKey", "404", "AccessDenied", "403")
+
+
+def open_store(url, s3_client=None, pool=None):
+    """
+    Open the tile store at *url*. S3 stores get their client (and a pool to
+    upload with) by calling *s3_client* (and *pool*) when they're first used.
+    """
+    scheme, _, location = url.partition("://")
+
+    if scheme == "s3":
+        return S3Store(location, s3_client, pool)
+
+    if scheme == "file":
+        return DirectoryStore(location)
+
+    if scheme == "bundle":
+        return BundleStore(location)
+
+    raise Exception("Invalid tile store: {}".format(url))
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class S3Store(object):
+    def __init__(self, bucket, client, pool=None):
+        self.bucket = bucket
+        self.client = client
+        self.pool = pool
+
+    def url(self, key, bucket=None):
+        return "http://{}.s3.amazonaws.com/{}".format(bucket or self.bucket, key)
+
+    def get(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client().get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in S3_MISSING:
+                return None
+
+            raise
+
+        return response["Body"].read()
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client().head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in S3_MISSING:
+                return False
+
+            raise
+
+        return True
+
+    def put(self, objects):
+        """
+        Store objects concurrently (on *pool*), each in its own Bucket if it
+        has one.
+        """
+        client = self.client()
+        objects = [dict(o, Bucket=o.get("Bucket", self.bucket)) for o in objects]
+
+        if len(objects) == 1 or self.pool is None:
+            for o in objects:
+                client.put_object(**o)
+        elif objects:
+            self.pool().map(lambda o: client.put_object(**o), objects)
+
+        return [self.url(o["Key"], o["Bucket"]) for o in objects]
+
+
+class DirectoryStore(object):
+    """
+    Tiles stored as files under *path*, named by their keys. Files are
+    written to a temporary name and renamed into place, so readers never
+    see partial tiles.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def url(self, key):
+        return "file://{}".format(os.path.join(self.path, key))
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.path, key), "rb") as f:
+                return f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+
+            raise
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.path, key))
+
+    def put(self, objects):
+        for o in objects:
+            path = os.path.join(self.path, o["Key"])
+            # one per thread, as threads may store the same key at once
+            tmp_path = "{}.{}-{}.tmp".format(path, os.getpid(), threading.current_thread().ident)
+
+            makedirs(os.path.dirname(path))
+
+            with open(tmp_path, "wb") as f:
+                f.write(o["Body"])
+
+            os.rename(tmp_path, path)
+
+        return [self.url(o["Key"]) for o in objects]
+
+
+class BundleStore(object):
+    """
+    Tiles packed into bundle files under *path*, each holding a *size* x
+    *size* block of tiles with the same prefix and suffix (e.g.
+    3857/12/654/1582.tif is in 3857/12/40/98.tif.bundle, with size 16).
+    Keys that don't end in {z}/{x}/{y}{suffix} are stored as files, as by
+    DirectoryStore.
+
+    A bundle starts with a header (MAGIC and size) and an index of
+    (offset, length) for each of its tiles, in rows, followed by their
+    data. Reads are two seeks (the index entry, then the tile) under a
+    shared lock; put() appends every tile headed for a bundle with a single
+    write under an exclusive lock, then points the index at them. Tiles
+    that are replaced leave their old data behind.
+    """
+
+    KEY = re.compile(r"^(?P<prefix>.+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)(?P<suffix>[^/]*)$")
+    MAGIC = b"OTB1"
+    HEADER = struct.Struct("<4sI")
+    ENTRY = struct.Struct("<QI")
+
+    def __init__(self, path, size=TILE_BUNDLE_SIZE):
+        self.path = path
+        self.size = size
+        self.files = DirectoryStore(path)
+
+    def url(self, key):
+        return "bundle://{}".format(os.path.join(self.path, key))
+
+    def locate(self, key):
+        """
+        Return the path of the bundle containing *key* and the position of
+        its entry in the bundle's index, or None if it's not in a bundle.
+        """
+        match = self.KEY.match(key)
+
+        if match is None:
+            return None
+
+        z, x, y = [int(match.group(n)) for n in ("z", "x", "y")]
+        path = os.path.join(self.path, match.group("prefix"), str(z), str(x // self.size),
+                            "{}{}.bundle".format(y // self.size, match.group("suffix")))
+
+        return path, (y % self.size) * self.size + x % self.size
+
+    def get(self, key):
+        location = self.locate(key)
+
+        if location is None:
+            return self.files.get(key)
+
+        path, index = location
+
+        try:
+            f = open(path, "rb")
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+
+            raise
+
+        with f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+
+            f.seek(self.HEADER.size + index * self.ENTRY.size)
+            entry = f.read(self.ENTRY.size)
+
+            # bundles are created with their index, but may be opened before that's been written
+            if len(entry) < self.ENTRY.size:
+                return None
+
+            offset, length = self.ENTRY.unpack(entry)
+
+            if length == 0:
+                return None
+
+            f.seek(offset)
+
+            return f.read(length)
+
+    def exists(self, key):
+        location = self.locate(key)
+
+        if location is None:
+            return self.files.exists(key)
+
+        return self.get(key) is not None
+
+    def put(self, objects):
+        bundles = OrderedDict()
+        files = []
+
+        for o in objects:
+            location = self.locate(o["Key"])
+
+            if location is None:
+                files.append(o)
+            else:
+                path, index = location
+                bundles.setdefault(path, []).append((index, o["Body"]))
+
+        for path, tiles in bundles.items():
+            self.append(path, tiles)
+
+        self.files.put(files)
+
+        return [self.url(o["Key"]) for o in objects]
+
+    def append(self, path, tiles):
+        """
+        Append a list of (index, body) to the bundle at *path*, creating it
+        if necessary.
+        """
+        makedirs(os.path.dirname(path))
+
+        with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+
+            if offset == 0:
+                f.write(self.HEADER.pack(self.MAGIC, self.size))
+                f.write(b"\0" * (self.ENTRY.size * self.size * self.size))
+                offset = f.tell()
+            else:
+                f.seek(0)
+                magic, size = self.HEADER.unpack(f.read(self.HEADER.size))
+
+                if magic != self.MAGIC or size != self.size:
+                    raise Exception("Invalid bundle: {}".format(path))
+
+                f.seek(offset)
+
+            f.write(b"".join(body for _, body in tiles))
+
+            for index, body in tiles:
+                f.seek(self.HEADER.size + index * self.ENTRY.size)
+                f.write(self.ENTRY.pack(offset, len(body)))
+                offset += len(body)
+
+            f.flush()
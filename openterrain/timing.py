@@ -0,0 +1,167 @@
+# coding=utf-8
+"""
+Per-request timing of the render pipeline's stages.
+
+Handlers wrap each request in request(), and the pipeline wraps each stage
+(source read, shading, encoding, S3 requests, etc.) in span(); spans
+outside of a request cost next to nothing and are discarded. When the
+request finishes, its record
+
+    {"request": {...}, "ms": ..., "cpu_ms": ..., "peak_rss_mb": ...,
+     "rss_growth_mb": ..., "spans": [{"name": ..., "start_ms": ..., "ms": ..., ...}]}
+
+is logged as a single JSON line (unless LOG_TIMINGS is off) and passed to
+each function in HOOKS.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+
+LOG_TIMINGS = os.environ.get("LOG_TIMINGS", "true").lower() in ("1", "true", "yes")
+
+# functions called with each finished request's record
+HOOKS = []
+
+_local = threading.local()
+
+
+class Request(object):
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.spans = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def record(self):
+        with self._lock:
+            return {
+                "request": self.attributes,
+                "ms": round((time.time() - self.started) * 1000, 2),
+                "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+            }
+
+
+def rss():
+    """
+    Return this process's (current, peak) resident set size in bytes, the
+    peak being since reset_peak_rss() was last called (where supported) or
+    since the process started. current is None where it can't be read.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if line.startswith(("VmRSS", "VmHWM")))
+
+        return int(status["VmRSS"].split()[0]) * 1024, int(status["VmHWM"].split()[0]) * 1024
+    except (IOError, OSError, KeyError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # kB on Linux, bytes on macOS
+        return None, usage if sys.platform == "darwin" else usage * 1024
+
+
+def reset_peak_rss():
+    """
+    Reset the peak reported by rss() to the current resident set size
+    (Linux only; elsewhere, the peak is the process's). Returns whether it
+    was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except (IOError, OSError):
+        return False
+
+    return True
+
+
+def current():
+    """
+    The request being timed on this thread, if any (to pass to attach() on
+    another thread).
+    """
+    return getattr(_local, "request", None)
+
+
+@contextmanager
+def attach(request):
+    """
+    Time spans on this thread as part of *request* (from current()).
+    """
+    previous = current()
+    _local.request = request
+
+    try:
+        yield
+    finally:
+        _local.request = previous
+
+
+@contextmanager
+def request(**attributes):
+    """
+    Time a request; *attributes* (e.g. the tile) are included in its record,
+    along with its peak resident set size and how far that is above the
+    size when it started. Requests running concurrently share a process,
+    so their peaks overlap (and each only covers the time since the latest
+    of them started).
+    """
+    cpu = os.times()
+    reset_peak_rss()
+    start_rss, _ = rss()
+
+    with attach(Request(attributes)):
+        try:
+            yield
+        except Exception as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            req = current()
+            record = req.record()
+
+            elapsed = os.times()
+            record["cpu_ms"] = round((elapsed[0] + elapsed[1] - cpu[0] - cpu[1]) * 1000, 2)
+            _, peak = rss()
+            record["peak_rss_mb"] = round(peak / (1024.0 * 1024), 1)
+
+            if start_rss is not None:
+                record["rss_growth_mb"] = round((peak - start_rss) / (1024.0 * 1024), 1)
+
+            if LOG_TIMINGS:
+                sys.stdout.write(json.dumps(record, sort_keys=True) + "\n")
+
+            for hook in HOOKS:
+                hook(record)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a stage of the current request. Yields a dict that further
+    attributes (cache hits, bytes, etc.) can be added to.
+    """
+    req = current()
+
+    if req is None:
+        yield {}
+        return
+
+    start = time.time()
+    attributes["name"] = name
+
+    try:
+        yield attributes
+    finally:
+        attributes["start_ms"] = round((start - req.started) * 1000, 2)
+        attributes["ms"] = round((time.time() - start) * 1000, 2)
+        req.add(attributes)
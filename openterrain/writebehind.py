@@ -0,0 +1,66 @@
+# coding=utf-8
+"""
+Write-behind: run calls (e.g. encoding and uploading hillshades) on a
+background thread so that the caller can carry on, then wait for them with
+flush() before the request is over.
+"""
+
+import sys
+import threading
+
+from openterrain import timing
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+
+class WriteBehind(object):
+    """
+    Runs submitted calls in order on a single background thread. At most
+    *max_pending* calls are queued; submit() blocks while the queue is full.
+    """
+
+    def __init__(self, max_pending):
+        self._queue = Queue(max_pending)
+        self._failures = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, fn, *args, **kwargs):
+        self._start()
+        # time it as part of the request that submitted it
+        self._queue.put((timing.current(), fn, args, kwargs))
+
+    def flush(self):
+        """
+        Wait for every call submitted so far to finish, returning the
+        exc_info of each that failed since the last flush().
+        """
+        self._queue.join()
+
+        with self._lock:
+            failures, self._failures = self._failures, []
+
+        return failures
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            request, fn, args, kwargs = self._queue.get()
+
+            try:
+                with timing.attach(request):
+                    fn(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self._failures.append(sys.exc_info())
+            finally:
+                self._queue.task_done()
@@ -1,25 +1,133 @@
-from custom import handle
+"""
+A WSGI server for the tiles rendered by custom.py:
+
+    GET /{style}/{z}/{x}/{y}[@2x].png  (style defaults to positron)
+    POST /batch                        (see openterrain.batch)
+
+Run it with `python server.py [--host HOST] [--port PORT]` (one process,
+a thread per request), or under a production WSGI server, e.g.
+
+    gunicorn --workers 4 --threads 8 server:app
+
+Responses carry a strong ETag (so If-None-Match revalidations are answered
+with 304s) and CACHE_CONTROL. Invalid paths and batches are answered with
+400s; anything else that goes wrong is logged (to wsgi.errors) and
+answered with a 500.
+"""
+
+import argparse
+import json
+import os
+import re
+import traceback
+from wsgiref.simple_server import make_server, WSGIServer
+
+try:
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from socketserver import ThreadingMixIn
+
+from custom import get_tile, handle_batch, parse_tile, STYLES
+
+CACHE_CONTROL = os.environ.get("CACHE_CONTROL", "public, max-age=2592000")
+
+TILE_PATH = re.compile(r"^/(?:(?P<style>[a-z-]+)/)?(?P<z>[^/]+)/(?P<x>[^/]+)/(?P<y>[^/]+)$")
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def respond(start_response, status, body=b"", content_type="text/plain", headers=[]):
+    start_response(status, [
+        ("Content-Type", content_type),
+        ("Content-Length", str(len(body))),
+    ] + headers)
+
+    return [body]
+
+
+def server_error(environ, start_response):
+    """
+    Log the exception being handled and respond with a 500.
+    """
+    environ["wsgi.errors"].write(traceback.format_exc())
+
+    return respond(start_response, "500 Internal Server Error")
+
+
+def matches(etag, if_none_match):
+    """
+    Check whether an If-None-Match header value matches *etag* (compared
+    weakly, as RFC 7232 requires).
+    """
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+
+    return "*" in tags or etag in [re.sub(r"^W/", "", tag) for tag in tags]
+
 
 def app(environ, start_response):
-    """Simplest possible application object"""
-    path_info = environ.get('PATH_INFO', None)
-    components = path_info[1:].split('/')
-    print components
-
-    data = handle({
-        'params': {
-            'path': {
-                'z': components[0],
-                'x': components[1],
-                'y': components[2],
-            }
-        }
-    })
-
-    status = '200 OK'
-    response_headers = [
-        ('Content-type','image/png'),
-        ('Content-Length', str(len(data)))
-    ]
-    start_response(status, response_headers)
-    return iter([data])
+    path_info = environ.get("PATH_INFO", "")
+    method = environ["REQUEST_METHOD"]
+
+    if path_info == "/batch":
+        if method != "POST":
+            return respond(start_response, "405 Method Not Allowed", headers=[("Allow", "POST")])
+
+        # render a batch of tiles (see openterrain.batch) into the tile cache
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+
+        try:
+            result = handle_batch(json.loads(environ["wsgi.input"].read(length).decode("utf-8")))
+        except ValueError as e:
+            # malformed JSON or an invalid batch
+            return respond(start_response, "400 Bad Request", str(e).encode("utf-8"))
+        except Exception:
+            return server_error(environ, start_response)
+
+        return respond(start_response, "200 OK", json.dumps(result).encode("utf-8"), "application/json")
+
+    match = TILE_PATH.match(path_info)
+
+    if match is None or (match.group("style") or "positron") not in STYLES:
+        return respond(start_response, "404 Not Found")
+
+    if method not in ("GET", "HEAD"):
+        return respond(start_response, "405 Method Not Allowed", headers=[("Allow", "GET, HEAD")])
+
+    try:
+        tile, scale = parse_tile(match.group("z"), match.group("x"), match.group("y"))
+    except ValueError as e:
+        return respond(start_response, "400 Bad Request", str(e).encode("utf-8"))
+
+    try:
+        data, etag = get_tile(match.group("style") or "positron", tile, scale)
+    except Exception:
+        return server_error(environ, start_response)
+
+    headers = [("ETag", etag), ("Cache-Control", CACHE_CONTROL)]
+
+    if matches(etag, environ.get("HTTP_IF_NONE_MATCH", "")):
+        start_response("304 Not Modified", headers)
+        return []
+
+    start_response("200 OK", [
+        ("Content-Type", "image/png"),
+        ("Content-Length", str(len(data))),
+    ] + headers)
+
+    return [data if method == "GET" else b""]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, app, server_class=ThreadingWSGIServer)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,8 @@
-from matplotlib.colors import LinearSegmentedColormap
-import matplotlib.pyplot as plt
 from mercantile import Tile
 import rasterio
 
 from openterrain import render_hillshade
+from openterrain.colorize import compile_ramp, encode_png
 
 POSITRON_RAMP = {
     "red": [(0.0, 0.0, 0.0),
@@ -17,11 +16,11 @@ POSITRON_RAMP = {
               (1.0, 1.0, 1.0)]
 }
 
-POSITRON = LinearSegmentedColormap("positron", POSITRON_RAMP)
+POSITRON = compile_ramp(POSITRON_RAMP)
 
 
 meta = {}
-hs = render_hillshade(Tile(722, 1579, 12), src_meta=meta, resample_factor=0.8)
+hs = render_hillshade(Tile(722, 1579, 12), src_meta=meta, resample=True)
 
 meta.update(
     driver="GTiff",
@@ -38,17 +37,11 @@ meta.update(
 with rasterio.open("/tmp/12_722_1579_resampled.tif", "w", **meta) as tmp:
     tmp.write(hs, 1)
 
-plt.imsave(
-    "/tmp/12_722_1579_resampled.png",
-    hs,
-    cmap=POSITRON,
-    vmin=0,
-    vmax=255,
-    format="png",
-)
+with open("/tmp/12_722_1579_resampled.png", "wb") as f:
+    f.write(encode_png(hs, POSITRON))
 
 meta = {}
-hs = render_hillshade(Tile(722, 1579, 12), src_meta=meta, resample_factor=1.0)
+hs = render_hillshade(Tile(722, 1579, 12), src_meta=meta, resample=False)
 
 meta.update(
     driver="GTiff",
@@ -65,11 +58,5 @@ meta.update(
 with rasterio.open("/tmp/12_722_1579.tif", "w", **meta) as tmp:
     tmp.write(hs, 1)
 
-plt.imsave(
-    "/tmp/12_722_1579.png",
-    hs,
-    cmap=POSITRON,
-    vmin=0,
-    vmax=255,
-    format="png",
-)
+with open("/tmp/12_722_1579.png", "wb") as f:
+    f.write(encode_png(hs, POSITRON))